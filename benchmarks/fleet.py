@@ -0,0 +1,48 @@
+"""
+Synthetic fleet configurations for benchmarks.
+"""
+import yaml
+
+LMS_SITE_CONFIGURATION = 'openedx.core.djangoapps.site_configuration.models.SiteConfiguration'
+DISCOVERY_PARTNER = 'course_discovery.apps.core.models.Partner'
+ECOMMERCE_SITE_CONFIGURATION = 'ecommerce.core.models.SiteConfiguration'
+
+
+def fleet_config(size):
+    """
+    Returns a parsed configuration with `size` organizations, each having a microsite.
+    It has global overrides for every service, a site specific override on every
+    tenth microsite and a context override on every hundredth microsite.
+    """
+    organizations = {'org{}'.format(i): {'name': 'Organization {}'.format(i)} for i in range(size)}
+    microsites = {
+        '$': {
+            'context_overrides': {},
+            'overrides': {
+                'lms': {LMS_SITE_CONFIGURATION: {'site_values': {'ENABLE_COMBINED_LOGIN_REGISTRATION': True}}},
+                'discovery': {DISCOVERY_PARTNER: {'lms_admin_url': None}},
+                'ecommerce': {ECOMMERCE_SITE_CONFIGURATION: {'payment_processors': 'paypal,cybersource'}},
+            },
+        },
+    }
+    for i in range(0, size, 10):
+        code = 'org{}'.format(i)
+        microsites[code] = {
+            'overrides': {'lms': {LMS_SITE_CONFIGURATION: {'site_values': {'PLATFORM_NAME': 'Special {}'.format(i)}}}},
+        }
+        if i % 100 == 0:
+            microsites[code]['context_overrides'] = {'ecommerce_domain': 'shop.{}.example.org'.format(code)}
+    return {
+        'main_domain': 'example.com',
+        'site_for_each_organization': True,
+        'organizations': organizations,
+        'microsites': microsites,
+    }
+
+
+def write_fleet_config(size, file_path):
+    """
+    Write a synthetic fleet configuration file.
+    """
+    with open(file_path, 'w') as file:
+        yaml.dump(fleet_config(size), file, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper))
@@ -0,0 +1,214 @@
+"""
+Benchmarks the stages of every service generator against a minimal stand-in
+django project on SQLite (see benchmarks/standin).
+
+For each fleet size, a synthetic configuration is generated, and the stages of
+every service run twice on a fresh database: a first run creating every row,
+then a re-run without configuration changes. Wall time, number and time of
+database queries, and peak python memory (tracemalloc) are reported per stage.
+
+Usage: python benchmarks/generators.py [--sizes 10,1000] [--services lms,ecommerce] [--output report.json]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import SUPPRESS, ArgumentParser
+from collections import Counter
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARKS_DIR, '..', 'scripts'))
+sys.path.append(os.path.join(BENCHMARKS_DIR, 'standin'))
+
+from fleet import write_fleet_config  # noqa: E402
+
+FLEET_SIZES = '10,1000,10000,50000'
+SERVICES = 'lms,discovery,ecommerce'
+CASES = ('first_run', 'rerun')
+
+
+class StageMeter:
+    """
+    Measures wall time, database queries and peak memory of generator stages.
+    """
+
+    def __init__(self):
+        self.results = []
+
+    def measure(self, case, stage, function):
+        from django.db import connection
+
+        queries = {'count': 0, 'time': 0.0}
+
+        def count_queries(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries['count'] += 1
+                queries['time'] += time.perf_counter() - start
+
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            result = function()
+        wall_time = time.perf_counter() - start
+
+        self.results.append({
+            'case': case,
+            'stage': stage,
+            'wall_time': wall_time,
+            'queries': queries['count'],
+            'query_time': queries['time'],
+            'peak_memory': tracemalloc.get_traced_memory()[1],
+        })
+        return result
+
+
+def run_lms(meter, case, config_file_path):
+    import generate_lms as service
+    from batching import BatchRunner
+    from generator_utils import load_config
+
+    runner = BatchRunner()
+    config = meter.measure(case, 'load_config', lambda: load_config(config_file_path, cache=False))
+    plan = meter.measure(case, 'build_plan', lambda: service.build_plan(config))
+    meter.measure(case, 'organizations', lambda: runner.run(
+        'organizations', plan['organizations'], lambda batch: service.create_organizations(batch, Counter())
+    ))
+    redirect_uris = {code: microsite['ecommerce_redirect_uri'] for code, microsite in plan['microsites'].items()}
+    meter.measure(case, 'ecommerce_redirect_urls', lambda: service.add_ecommerce_redirect_urls(
+        plan['ecommerce_sso_client'], redirect_uris, redirect_uris.keys()
+    ))
+    sites = meter.measure(case, 'sites', lambda: runner.run('sites', plan['microsites'], service.create_sites))
+    meter.measure(case, 'site_configurations', lambda: runner.run(
+        'site_configurations', plan['microsites'], lambda batch: service.create_site_configurations(batch, sites)
+    ))
+
+
+def run_discovery(meter, case, config_file_path):
+    import generate_discovery as service
+    from batching import BatchRunner
+    from generator_utils import load_config
+
+    runner = BatchRunner()
+    config = meter.measure(case, 'load_config', lambda: load_config(config_file_path, cache=False))
+    plan = meter.measure(case, 'build_plan', lambda: service.build_plan(config))
+    sites = meter.measure(case, 'sites', lambda: runner.run('sites', plan['microsites'], service.create_sites))
+    meter.measure(case, 'partners', lambda: runner.run(
+        'partners', plan['microsites'], lambda batch: service.create_partner(batch, sites)
+    ))
+
+
+def run_ecommerce(meter, case, config_file_path):
+    import generate_ecommerce as service
+    from batching import BatchRunner
+    from generator_utils import load_config, resolve_generated_values
+
+    runner = BatchRunner()
+    generated_values = {'SOCIAL_AUTH_EDX_OAUTH2_KEY': 'key', 'SOCIAL_AUTH_EDX_OAUTH2_SECRET': 'secret'}
+    config = meter.measure(case, 'load_config', lambda: load_config(config_file_path, cache=False))
+    plan = meter.measure(case, 'build_plan', lambda: service.build_plan(config))
+    sites = meter.measure(case, 'sites', lambda: runner.run('sites', plan['microsites'], service.create_sites))
+    partners = meter.measure(case, 'partners', lambda: runner.run(
+        'partners', plan['microsites'], lambda batch: service.create_partner(batch, sites)
+    ))
+    meter.measure(case, 'site_configurations', lambda: runner.run(
+        'site_configurations',
+        plan['microsites'],
+        lambda batch: service.create_site_configuration(
+            resolve_generated_values(batch, generated_values), sites, partners
+        )
+    ))
+
+
+SERVICE_RUNNERS = {
+    'lms': run_lms,
+    'discovery': run_discovery,
+    'ecommerce': run_ecommerce,
+}
+
+
+def benchmark_service(service, config_file_path):
+    """
+    Runs in a child process: set the stand-in project up on a fresh database,
+    and run the stages of a service twice.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+    import django
+    django.setup()
+
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    get_user_model().objects.create(username='ecommerce_worker')
+
+    tracemalloc.start()
+    meter = StageMeter()
+    for case in CASES:
+        SERVICE_RUNNERS[service](meter, case, config_file_path)
+    return meter.results
+
+
+def benchmark(sizes, services):
+    """
+    Benchmark every service for every fleet size, each service in its own process and database.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            config_file_path = os.path.join(directory, 'fleet-{}.yaml'.format(size))
+            write_fleet_config(size, config_file_path)
+
+            for service in services:
+                database = os.path.join(directory, '{}-{}.sqlite3'.format(service, size))
+                env = dict(os.environ, BENCHMARK_DATABASE=database)
+                output = subprocess.run(
+                    [sys.executable, __file__, '--child', service, config_file_path],
+                    env=env,
+                    check=True,
+                    stdout=subprocess.PIPE,
+                ).stdout
+                for result in json.loads(output):
+                    results.append(dict(result, service=service, size=size))
+                print_results(results, service, size)
+    return results
+
+
+def print_results(results, service, size):
+    print('\n{} - {} organizations'.format(service, size))
+    print('{:<10} {:<24} {:>10} {:>9} {:>11} {:>10}'.format(
+        'case', 'stage', 'wall (s)', 'queries', 'query (s)', 'peak (MB)'
+    ))
+    for result in results:
+        if result['service'] != service or result['size'] != size:
+            continue
+        print('{case:<10} {stage:<24} {wall_time:>10.3f} {queries:>9} {query_time:>11.3f} {memory:>10.1f}'.format(
+            memory=result['peak_memory'] / 1024 / 1024, **result
+        ))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Benchmark generator stages on synthetic fleets.")
+    parser.add_argument("--sizes", type=str, default=FLEET_SIZES, help="Comma separated numbers of organizations.")
+    parser.add_argument("--services", type=str, default=SERVICES, help="Comma separated services.")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this file.")
+    parser.add_argument("--child", nargs=2, metavar=('SERVICE', 'CONFIG'), help=SUPPRESS)
+    cli_args = parser.parse_args()
+
+    if cli_args.child:
+        json.dump(benchmark_service(*cli_args.child), sys.stdout)
+        sys.exit(0)
+
+    all_results = benchmark(
+        [int(size) for size in cli_args.sizes.split(',')],
+        cli_args.services.split(','),
+    )
+    if cli_args.output:
+        with open(cli_args.output, 'w') as file:
+            json.dump(all_results, file, indent=1)
@@ -0,0 +1,49 @@
+"""
+Measures the memory held by a loaded Config for growing fleets.
+
+Usage: python benchmarks/memory.py [--sizes 1000,10000,50000]
+"""
+import gc
+import os
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from generator_utils import Config  # noqa: E402
+from fleet import fleet_config  # noqa: E402
+
+FLEET_SIZES = '1000,10000,50000'
+
+
+def measure(size, resolve_contexts):
+    """
+    Returns the bytes still held by a Config once the parsed data is released,
+    including the parts of the parsed data it keeps.
+    """
+    gc.collect()
+    tracemalloc.start()
+    data = fleet_config(size)
+    config = Config(data, resolve_contexts=resolve_contexts)
+    del data
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del config
+    return current
+
+
+def main(sizes):
+    print('{:>8} {:>16} {:>16} {:>14}'.format('sites', 'lazy (MB)', 'eager (MB)', 'eager B/site'))
+    for size in sizes:
+        lazy = measure(size, 'lazy')
+        eager = measure(size, 'eager')
+        print('{:>8} {:>16.2f} {:>16.2f} {:>14.0f}'.format(size, lazy / 1024 / 1024, eager / 1024 / 1024, eager / size))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Measure the memory held by a loaded Config.")
+    parser.add_argument("--sizes", type=str, default=FLEET_SIZES, help="Comma separated numbers of organizations.")
+    cli_args = parser.parse_args()
+    main([int(size) for size in cli_args.sizes.split(',')])
@@ -0,0 +1,44 @@
+"""
+Measures the cost of Config.apply_overrides per microsite for growing fleets.
+
+Usage: python benchmarks/overrides.py
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from generator_utils import Config  # noqa: E402
+from fleet import LMS_SITE_CONFIGURATION, fleet_config  # noqa: E402
+
+FLEET_SIZES = (10, 100, 1000, 10000)
+
+
+def site_configuration(context):
+    return {
+        'enabled': True,
+        'site_values': {
+            'PLATFORM_NAME': context['name'],
+            'SITE_NAME': context['lms_domain'],
+            'LMS_ROOT_URL': context['lms_url'],
+        },
+    }
+
+
+def main():
+    print('{:>8} {:>14}'.format('sites', 'us / microsite'))
+    for size in FLEET_SIZES:
+        config = Config(fleet_config(size))
+        codes = list(config.get_microsite_codes())
+
+        start = time.perf_counter()
+        for code in codes:
+            config.apply_overrides(code, 'lms', LMS_SITE_CONFIGURATION, site_configuration(config.get_context(code)))
+        elapsed = time.perf_counter() - start
+
+        print('{:>8} {:>14.2f}'.format(size, elapsed / size * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2 @@
+def organizations_enabled():
+    return True
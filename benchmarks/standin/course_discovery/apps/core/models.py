@@ -0,0 +1,14 @@
+from django.contrib.sites.models import Site
+from django.db import models
+
+
+class Partner(models.Model):
+    name = models.CharField(max_length=128, unique=True)
+    short_code = models.CharField(max_length=8, unique=True)
+    site = models.OneToOneField(Site, on_delete=models.PROTECT)
+    courses_api_url = models.URLField(max_length=255, null=True, blank=True)
+    ecommerce_api_url = models.URLField(max_length=255, null=True, blank=True)
+    organizations_api_url = models.URLField(max_length=255, null=True, blank=True)
+    lms_url = models.URLField(max_length=255, null=True, blank=True)
+    lms_admin_url = models.URLField(max_length=255, null=True, blank=True)
+    studio_url = models.URLField(max_length=255, null=True, blank=True)
@@ -0,0 +1,11 @@
+from django.contrib.sites.models import Site
+from django.db import models
+
+
+class SiteConfiguration(models.Model):
+    site = models.OneToOneField(Site, on_delete=models.CASCADE)
+    partner = models.ForeignKey('ecommerce_partner.Partner', on_delete=models.CASCADE)
+    lms_url_root = models.URLField()
+    discovery_api_url = models.URLField(blank=True)
+    payment_processors = models.CharField(max_length=255, blank=True, default='')
+    oauth_settings = models.JSONField(default=dict, blank=True)
@@ -0,0 +1,8 @@
+from django.contrib.sites.models import Site
+from django.db import models
+
+
+class Partner(models.Model):
+    name = models.CharField(max_length=128, blank=True)
+    short_code = models.CharField(max_length=8, unique=True)
+    default_site = models.OneToOneField(Site, null=True, blank=True, on_delete=models.PROTECT)
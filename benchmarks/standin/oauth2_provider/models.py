@@ -0,0 +1,19 @@
+import uuid
+
+from django.conf import settings
+from django.db import models
+
+
+def generate_client_id():
+    return uuid.uuid4().hex
+
+
+class Application(models.Model):
+    client_id = models.CharField(max_length=100, unique=True, default=generate_client_id)
+    client_secret = models.CharField(max_length=255, blank=True, default=generate_client_id)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE)
+    redirect_uris = models.TextField(blank=True)
+    client_type = models.CharField(max_length=32)
+    authorization_grant_type = models.CharField(max_length=32)
+    name = models.CharField(max_length=255, blank=True)
+    skip_authorization = models.BooleanField(default=False)
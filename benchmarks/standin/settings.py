@@ -0,0 +1,44 @@
+"""
+Django settings of the benchmark stand-in project.
+
+The stand-in packages mirror the import paths used by the generators, with only
+the models and fields the generators touch. Every service run uses its own
+SQLite database, given with the BENCHMARK_DATABASE environment variable.
+A second SQLite database given with BENCHMARK_REPLICA_DATABASE is available as
+the `replica` alias, e.g. to try `--read-db replica`.
+"""
+import os
+
+SECRET_KEY = 'benchmark'
+DEBUG = False
+USE_TZ = True
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCHMARK_DATABASE', ':memory:'),
+    }
+}
+
+if os.environ.get('BENCHMARK_REPLICA_DATABASE'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['BENCHMARK_REPLICA_DATABASE'],
+    }
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sites',
+    'standin_apps.SiteConfigurationConfig',
+    'standin_apps.OrganizationsConfig',
+    'standin_apps.OAuth2ProviderConfig',
+    'standin_apps.DiscoveryCoreConfig',
+    'standin_apps.EcommerceCoreConfig',
+    'standin_apps.EcommercePartnerConfig',
+]
+
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+# the Partner models of discovery and eCommerce share one project here, their reverse accessors on Site clash
+SILENCED_SYSTEM_CHECKS = ['fields.E304', 'fields.E305']
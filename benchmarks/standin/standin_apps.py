@@ -0,0 +1,35 @@
+"""
+App configs of the stand-in models. Labels are explicit, as several services
+have apps with the same name.
+"""
+from django.apps import AppConfig
+
+
+class SiteConfigurationConfig(AppConfig):
+    name = 'openedx.core.djangoapps.site_configuration'
+    label = 'site_configuration'
+
+
+class OrganizationsConfig(AppConfig):
+    name = 'organizations'
+    label = 'organizations'
+
+
+class OAuth2ProviderConfig(AppConfig):
+    name = 'oauth2_provider'
+    label = 'oauth2_provider'
+
+
+class DiscoveryCoreConfig(AppConfig):
+    name = 'course_discovery.apps.core'
+    label = 'discovery_core'
+
+
+class EcommerceCoreConfig(AppConfig):
+    name = 'ecommerce.core'
+    label = 'ecommerce_core'
+
+
+class EcommercePartnerConfig(AppConfig):
+    name = 'ecommerce.extensions.partner'
+    label = 'ecommerce_partner'
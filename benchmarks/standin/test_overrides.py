@@ -0,0 +1,101 @@
+"""
+Tests of the precedence of planned values and overrides. These don't need the
+database, see test_reconcile for how to run them.
+"""
+import os
+import tempfile
+from unittest import TestCase
+
+import yaml
+
+from generator_utils import LMS_SITE_CONFIGURATION, MergePlan, OverrideTemplate, load_config, merge_overrides
+
+
+class MergeOverridesTest(TestCase):
+
+    def test_deep_merge(self):
+        data = {'a': 1, 'nested': {'b': 2, 'c': 3}}
+
+        merged = merge_overrides(data, {'nested': {'c': 4, 'd': 5}, 'e': 6})
+
+        self.assertEqual(merged, {'a': 1, 'nested': {'b': 2, 'c': 4, 'd': 5}, 'e': 6})
+
+    def test_arguments_are_not_modified(self):
+        data = {'nested': {'b': 2}}
+        overrides = {'nested': {'b': 3}}
+
+        merge_overrides(data, overrides)
+
+        self.assertEqual(data, {'nested': {'b': 2}})
+        self.assertEqual(overrides, {'nested': {'b': 3}})
+
+    def test_non_dict_values_are_replaced(self):
+        self.assertEqual(merge_overrides({'a': {'b': 1}}, {'a': 'value'}), {'a': 'value'})
+        self.assertEqual(merge_overrides({'a': 'value'}, {'a': {'b': 1}}), {'a': {'b': 1}})
+
+
+class MergePlanTest(TestCase):
+
+    def setUp(self):
+        self.plan = MergePlan()
+        self.plan.global_overrides = {'site_values': {'KEY': 'global', 'GLOBAL': 'global'}}
+        self.plan.site_overrides['a'] = {
+            'site_values': {'KEY': 'site', 'SITE': 'site', 'course_org_filter': 'site'}
+        }
+
+    def test_planned_values_take_precedence(self):
+        values = self.plan.apply('a', {'site_values': {'KEY': 'planned'}})
+
+        self.assertEqual(values['site_values']['KEY'], 'planned')
+        self.assertEqual(values['site_values']['GLOBAL'], 'global')
+        self.assertEqual(values['site_values']['SITE'], 'site')
+
+    def test_global_overrides_take_precedence_over_site_ones(self):
+        values = self.plan.apply('a', {})
+
+        self.assertEqual(values['site_values']['KEY'], 'global')
+
+    def test_template_takes_precedence_over_site_overrides(self):
+        self.plan.template = OverrideTemplate(('site_values', 'course_org_filter'))
+
+        self.assertEqual(self.plan.apply('a', {})['site_values']['course_org_filter'], 'a')
+        self.assertEqual(self.plan.apply('b', {})['site_values']['course_org_filter'], 'b')
+
+    def test_without_overrides(self):
+        data = {'site_values': {}}
+
+        self.assertIs(MergePlan().apply('a', data), data)
+
+
+class ConfigOverridesTest(TestCase):
+
+    def setUp(self):
+        config = {
+            'main_domain': 'example.com',
+            'organizations': {'a': {'name': 'A'}},
+            'microsites': {
+                '$': {'overrides': {'lms': {LMS_SITE_CONFIGURATION: {'site_values': {'KEY': 'global'}}}}},
+                'a': {
+                    'name': 'A',
+                    'overrides': {'lms': {LMS_SITE_CONFIGURATION: {'site_values': {'KEY': 'site', 'SITE': 'site'}}}},
+                },
+            },
+        }
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_path = os.path.join(directory.name, 'config.yaml')
+        with open(file_path, 'w') as file:
+            yaml.safe_dump(config, file)
+        self.config = load_config(file_path, cache=False)
+
+    def test_apply_overrides(self):
+        values = self.config.apply_overrides(
+            'a', 'lms', LMS_SITE_CONFIGURATION, {'site_values': {'PLANNED': 'planned'}}
+        )
+
+        self.assertEqual(values['site_values'], {'KEY': 'global', 'SITE': 'site', 'PLANNED': 'planned'})
+
+    def test_other_models_are_not_overridden(self):
+        data = {'domain': 'a.example.com'}
+
+        self.assertIs(self.config.apply_overrides('a', 'lms', 'django.contrib.sites.models.Site', data), data)
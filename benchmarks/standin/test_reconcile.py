@@ -0,0 +1,169 @@
+"""
+Tests of the reconciliation of generated rows, on the stand-in project.
+
+Run from the repository root:
+
+    BENCHMARK_REPLICA_DATABASE=:memory: PYTHONPATH=benchmarks/standin:scripts \
+        python -m django test benchmarks/standin --settings settings
+
+Read routing tests are skipped without BENCHMARK_REPLICA_DATABASE.
+"""
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.test import TestCase
+from organizations.models import Organization
+
+from reconcile import Reconciliation, read_routing
+
+# the replica alias only exists with BENCHMARK_REPLICA_DATABASE
+REPLICA = 'replica' in settings.DATABASES
+
+
+def reconcile(model_class, lookup_field, desired, **kwargs):
+    """
+    Classify and save desired rows, by code. Returns the reconciliation and saved instances.
+    """
+    reconciliation = Reconciliation(model_class, lookup_field, **kwargs)
+    for code, values in desired.items():
+        reconciliation.add(code, values)
+    reconciliation.classify()
+    return reconciliation, reconciliation.save()
+
+
+class ReconciliationTest(TestCase):
+
+    def test_classify(self):
+        Organization.objects.create(short_name='a', name='A', active=True)
+        Organization.objects.create(short_name='b', name='B', active=True)
+
+        reconciliation, instances = reconcile(Organization, 'short_name', {
+            'a': {'short_name': 'a', 'name': 'A', 'active': True},
+            'b': {'short_name': 'b', 'name': 'B renamed', 'active': True},
+            'c': {'short_name': 'c', 'name': 'C', 'active': True},
+        })
+
+        self.assertEqual(set(reconciliation.unchanged), {'a'})
+        self.assertEqual(set(reconciliation.to_update), {'b'})
+        self.assertEqual(reconciliation.to_update['b'][1], ['name'])
+        self.assertEqual(set(reconciliation.to_create), {'c'})
+        self.assertEqual((reconciliation.created, reconciliation.updated), (1, 1))
+        self.assertEqual(Organization.objects.get(short_name='b').name, 'B renamed')
+        self.assertEqual(
+            {code: instance.pk for code, instance in instances.items()},
+            dict(Organization.objects.values_list('short_name', 'pk')),
+        )
+
+    def test_rerun_is_unchanged(self):
+        desired = {'a': {'short_name': 'a', 'name': 'A', 'active': True}}
+        reconcile(Organization, 'short_name', desired)
+
+        with self.assertNumQueries(1):
+            reconciliation, _ = reconcile(Organization, 'short_name', desired)
+        self.assertEqual(set(reconciliation.unchanged), {'a'})
+
+    def test_existing_rows_are_not_updated(self):
+        Site.objects.create(domain='a.example.com', name='old')
+
+        reconciliation, instances = reconcile(
+            Site, 'domain', {'a': {'domain': 'a.example.com', 'name': 'new'}}, update=False
+        )
+
+        self.assertEqual(set(reconciliation.unchanged), {'a'})
+        self.assertEqual(instances['a'].name, 'old')
+
+    def test_duplicate_lookup_values_create_one_row(self):
+        reconciliation, instances = reconcile(Site, 'domain', {
+            'a': {'domain': 'shared.example.com', 'name': 'shared'},
+            'b': {'domain': 'shared.example.com', 'name': 'shared'},
+        })
+
+        self.assertEqual(Site.objects.filter(domain='shared.example.com').count(), 1)
+        self.assertEqual(reconciliation.created, 1)
+        self.assertIs(instances['a'], instances['b'])
+        self.assertIsNotNone(instances['a'].pk)
+
+    def test_created_rows_are_fetched_without_returned_primary_keys(self):
+        def bulk_create(instances):
+            # like MySQL, don't set the primary keys of created rows
+            Organization.objects.bulk_create(instances)
+            for instance in instances:
+                instance.pk = None
+
+        with mock.patch.object(Reconciliation, '_bulk_create', side_effect=bulk_create):
+            _, instances = reconcile(Organization, 'short_name', {
+                'a': {'short_name': 'a', 'name': 'A', 'active': True},
+                'b': {'short_name': 'b', 'name': 'B', 'active': True},
+            })
+
+        self.assertEqual(
+            {code: instance.pk for code, instance in instances.items()},
+            dict(Organization.objects.values_list('short_name', 'pk')),
+        )
+
+    def test_merge(self):
+        Organization.objects.create(short_name='a', name='A', description='edited', active=True)
+
+        def keep_description(instance, values):
+            return dict(values, description=instance.description)
+
+        reconciliation, _ = reconcile(
+            Organization, 'short_name', {'a': {'short_name': 'a', 'name': 'A', 'description': ''}},
+            merge=keep_description,
+        )
+
+        self.assertEqual(set(reconciliation.unchanged), {'a'})
+        self.assertEqual(Organization.objects.get(short_name='a').description, 'edited')
+
+
+@skipUnless(REPLICA, 'needs BENCHMARK_REPLICA_DATABASE')
+class ReadRoutingTest(TestCase):
+    databases = {'default', 'replica'} if REPLICA else {'default'}
+
+    def setUp(self):
+        read_routing.alias = 'replica'
+        read_routing.written.clear()
+
+    def tearDown(self):
+        read_routing.alias = None
+        read_routing.written.clear()
+
+    def test_existing_rows_are_read_from_replica(self):
+        organization = Organization.objects.create(short_name='a', name='A', active=True)
+        Organization.objects.using('replica').create(pk=organization.pk, short_name='a', name='A', active=True)
+
+        with self.assertNumQueries(0, using='default'), self.assertNumQueries(1, using='replica'):
+            reconciliation, _ = reconcile(
+                Organization, 'short_name', {'a': {'short_name': 'a', 'name': 'A', 'active': True}}
+            )
+        self.assertEqual(set(reconciliation.unchanged), {'a'})
+
+    def test_rows_missing_from_replica_are_read_from_default(self):
+        Organization.objects.create(short_name='a', name='A', active=True)
+
+        reconciliation, _ = reconcile(
+            Organization, 'short_name', {'a': {'short_name': 'a', 'name': 'A', 'active': True}}
+        )
+
+        self.assertEqual(set(reconciliation.unchanged), {'a'})
+        self.assertEqual(Organization.objects.count(), 1)
+
+    def test_updates_are_written_to_default(self):
+        organization = Organization.objects.create(short_name='a', name='A', active=True)
+        Organization.objects.using('replica').create(pk=organization.pk, short_name='a', name='A', active=True)
+
+        reconcile(Organization, 'short_name', {'a': {'short_name': 'a', 'name': 'A renamed', 'active': True}})
+
+        self.assertEqual(Organization.objects.get(short_name='a').name, 'A renamed')
+        self.assertEqual(Organization.objects.using('replica').get(short_name='a').name, 'A')
+
+    def test_written_rows_are_read_from_default(self):
+        desired = {'a': {'short_name': 'a', 'name': 'A', 'active': True}}
+        reconcile(Organization, 'short_name', desired)
+        # the replica lags behind, and still has a stale copy
+        Organization.objects.using('replica').create(short_name='a', name='stale', active=True)
+
+        reconciliation, _ = reconcile(Organization, 'short_name', desired)
+
+        self.assertEqual(set(reconciliation.unchanged), {'a'})
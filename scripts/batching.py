@@ -0,0 +1,186 @@
+import logging
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
+from reconcile import chunked
+from instrumentation import instrumentation
+
+
+logger = logging.getLogger(__name__)
+
+# number of microsites written in a single transaction
+DEFAULT_BATCH_SIZE = 100
+
+
+class BatchReport:
+    """
+    Statistics of a single batch.
+    """
+
+    def __init__(self, stage, index, size):
+        self.stage = stage
+        self.index = index
+        self.size = size
+        self.rows_written = 0
+        self.duration = 0.0
+        # cursor of the last write query, whose row count is not counted yet
+        self._write_cursor = None
+
+    def count_writes(self, execute, sql, params, many, context):
+        """
+        Django database execute wrapper counting rows affected by write queries.
+
+        The row count of `INSERT ... RETURNING` queries is only set once the
+        returned rows are fetched, so it's read when the next query runs, or
+        when the batch ends.
+        """
+        self.count_pending_writes()
+        result = execute(sql, params, many, context)
+        if sql.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            self._write_cursor = context['cursor']
+        return result
+
+    def count_pending_writes(self):
+        """
+        Add the rows affected by the last write query to the count.
+        """
+        if self._write_cursor is not None:
+            self.rows_written += max(self._write_cursor.rowcount, 0)
+            self._write_cursor = None
+
+
+class BatchRunner:
+    """
+    Splits microsite codes into batches, runs each batch in its own transaction
+    and throttles writes between batches, so that a full regeneration does not
+    put a spike of writes on a live database.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, pause=0, max_writes_per_second=None, using='default',
+                 journal=None):
+        """
+        Args:
+            batch_size (int): number of microsites per transaction
+            pause (float): seconds to sleep after each batch
+            max_writes_per_second (float): upper bound of rows written per second
+            using (str): database alias the transactions are opened on
+            journal (Journal): records committed batches, and skips the ones of a resumed run
+        """
+        self.batch_size = batch_size
+        self.pause = pause
+        self.max_writes_per_second = max_writes_per_second
+        self.using = using
+        self.journal = journal
+        self.reports = []
+
+    @classmethod
+    def from_options(cls, options, journal=None):
+        """
+        Create a runner from parsed command line options.
+        """
+        return cls(
+            batch_size=options.batch_size,
+            pause=options.pause,
+            max_writes_per_second=options.max_writes_per_second,
+            journal=journal,
+        )
+
+    def run(self, stage, items, handler, skip_completed=True):
+        """
+        Call `handler(batch)` for each batch of items, each batch in its own transaction.
+
+        Args:
+            stage (str): stage name used in reports
+            items (iterable|dict): microsite or organization codes, or a mapping of
+                code and planned values, in which case batches are mappings too
+            handler (callable): function processing a batch, may return a dict
+            skip_completed (bool): skip codes completed by a resumed run. Disable it for
+                stages whose results are used by the next stages, completed codes are
+                then only looked up again.
+        Returns:
+            results (dict): merged results of every handler call
+        """
+        if self.journal is not None and skip_completed:
+            items = self.journal.pending(stage, items)
+
+        results = {}
+        batches = list(chunked(items, self.batch_size))
+        for index, batch in enumerate(batches, start=1):
+            if isinstance(items, Mapping):
+                batch = {code: items[code] for code in batch}
+            with self.batch(stage, len(batch), index, len(batches)):
+                results.update(handler(batch) or {})
+            if self.journal is not None:
+                self.journal.record(stage, batch)
+        return results
+
+    def stream(self, stage, items, handler):
+        """
+        Call `handler(batch)` for batches of (code, planned values) pairs pulled
+        from an iterator, each batch in its own transaction. Only the current batch
+        is held in memory, and each batch is fully written when it's committed.
+
+        Args:
+            stage (str): stage name used in reports
+            items (iterable): (code, planned values) pairs, e.g. from a generator
+            handler (callable): function processing a batch mapping of code and planned values
+        Returns:
+            count (int): number of processed items
+        """
+        count = 0
+        for index, batch in enumerate(chunked(items, self.batch_size), start=1):
+            batch = dict(batch)
+            if self.journal is not None:
+                batch = self.journal.pending(stage, batch)
+                if not batch:
+                    continue
+            with self.batch(stage, len(batch), index, '?'):
+                handler(batch)
+            if self.journal is not None:
+                self.journal.record(stage, batch)
+            count += len(batch)
+        return count
+
+    @contextmanager
+    def batch(self, stage, size=1, index=1, total=1):
+        """
+        Context manager running a batch of writes in one transaction, then reporting
+        it and throttling before the next batch.
+        """
+        from django.db import connections, transaction
+
+        report = BatchReport(stage, index, size)
+        start = time.monotonic()
+        with instrumentation.stage(stage), transaction.atomic(using=self.using):
+            with connections[self.using].execute_wrapper(report.count_writes):
+                yield report
+                report.count_pending_writes()
+        report.duration = time.monotonic() - start
+        self.reports.append(report)
+
+        logger.info('{}: batch {}/{} - {} items, {} rows written in {:.2f}s'.format(
+            stage, index, total, size, report.rows_written, report.duration
+        ))
+        self.throttle(report)
+
+    def throttle(self, report):
+        """
+        Sleep after a batch, according to the configured pause and write rate.
+        """
+        delay = self.pause
+        if self.max_writes_per_second:
+            minimum_duration = report.rows_written / self.max_writes_per_second
+            delay = max(delay, minimum_duration - report.duration)
+        if delay > 0:
+            time.sleep(delay)
+
+    def summary(self):
+        """
+        Log total rows written and time spent per stage.
+        """
+        stages = {}
+        for report in self.reports:
+            rows, duration = stages.get(report.stage, (0, 0.0))
+            stages[report.stage] = (rows + report.rows_written, duration + report.duration)
+        for stage, (rows, duration) in stages.items():
+            logger.info('{}: {} rows written in {:.2f}s'.format(stage, rows, duration))
@@ -5,3 +5,15 @@ LMS_ROOT_DIR = '/edx/app/edxapp/edx-platform'
 
 # don't modify this file, as this gets created dynamically everytime we run the generator
 GENERATED_SHARED_CONFIG_FILE = 'config/_generated.yaml'
+
+# fingerprints of the microsites applied by the last successful run of each service
+FINGERPRINTS_FILE = 'config/_fingerprints.json'
+
+# parsed configuration files are cached here, and reused until the file changes
+CONFIG_CACHE_DIR = 'config/_cache'
+
+# desired state of every service, compiled from the configuration by scripts/plan.py
+PLAN_FILE = 'config/_plan.json'
+
+# (stage, code) pairs committed by the current run of a service, formatted with the service key
+JOURNAL_FILE = 'config/_journal_{}.jsonl'
@@ -0,0 +1,58 @@
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# seconds between two checks of the watched files
+WATCH_INTERVAL = 0.5
+
+
+def get_version(path):
+    """
+    Returns what identifies the content of a file, or of every file of a directory,
+    None if it doesn't exist. Hidden files, e.g. editor swap files, are ignored.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if not os.path.isdir(path):
+        # a renamed file gets a new inode, even if written within the mtime resolution
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    versions = []
+    directories = [path]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    directories.append(entry.path)
+                else:
+                    stat = entry.stat()
+                    versions.append((entry.path, stat.st_mtime_ns, stat.st_size, stat.st_ino))
+    return hash(frozenset(versions))
+
+
+def watch(paths, apply, interval=WATCH_INTERVAL):
+    """
+    Call `apply()` once, then again whenever one of the watched paths changes,
+    until interrupted. Versions are taken before applying, so that a change made
+    while applying triggers another run.
+
+    Args:
+        paths (list): watched files or directories
+        apply (callable)
+        interval (float): seconds between two checks
+    """
+    logger.info('Watching {}'.format(', '.join(paths)))
+    applied = None
+    while True:
+        versions = [get_version(path) for path in paths]
+        if versions != applied:
+            applied = versions
+            apply()
+        time.sleep(interval)
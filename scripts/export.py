@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+from collections import Counter, defaultdict
+from reconcile import chunked, read_routing
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('json', 'sql')
+
+# maximum number of rows of a single multi-row INSERT statement
+INSERT_CHUNK_SIZE = 500
+
+
+def quote_value(value, vendor):
+    """
+    Returns the SQL literal of a database value.
+
+    Args:
+        value: value prepared for the database by the model field
+        vendor (str): database vendor, e.g. `mysql`
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        return repr(value)
+
+    value = str(value).replace("'", "''")
+    if vendor == 'mysql':
+        # backslashes are escape characters in MySQL string literals
+        value = value.replace('\\', '\\\\')
+    return "'{}'".format(value)
+
+
+class Export:
+    """
+    Writes new rows to a Django fixture (`json`) to load with `loaddata`, or to
+    multi-row INSERT statements (`sql`) to load with the database client.
+
+    Rows are written batch by batch as they are added, so only the current batch
+    is held in memory. Primary keys are allocated after the largest existing one,
+    so that related rows can reference each other; load the file before anything
+    else writes to the same tables. The file is written next to its destination
+    and only moved in place once complete.
+    """
+
+    def __init__(self, file_path, export_format='json', using='default'):
+        """
+        Args:
+            file_path (str): fixture or SQL file path
+            export_format (str): `json` or `sql`
+            using (str): database alias the rows are meant for
+        """
+        self.file_path = file_path
+        self.export_format = export_format
+        self.using = using
+
+        # next primary key by model
+        self._next_pks = {}
+        # number of rows written by model label
+        self.rows = Counter()
+        self._file = None
+        # whether a fixture entry has been written, the next ones are separated by commas
+        self._has_entries = False
+        self._tmp_path = '{}.{}.tmp'.format(file_path, os.getpid())
+
+    def __enter__(self):
+        self._file = open(self._tmp_path, 'w')
+        self._file.write('[' if self.export_format == 'json' else 'BEGIN;\n')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._file.write('\n]\n' if self.export_format == 'json' else 'COMMIT;\n')
+        self._file.close()
+        if exc_type is None:
+            os.replace(self._tmp_path, self.file_path)
+            logger.info('Exported {} to {}'.format(
+                ', '.join('{} {}'.format(count, label) for label, count in self.rows.items()) or 'no rows',
+                self.file_path
+            ))
+        else:
+            os.remove(self._tmp_path)
+
+    def existing(self, model_class, field_name, values):
+        """
+        Returns the set of lookup values which already have a row, so that they are not exported again.
+        """
+        return set(read_routing.prefetch(model_class, field_name, values))
+
+    def create(self, model_class, **values):
+        """
+        Returns an unsaved instance with a newly allocated primary key.
+        """
+        from django.db.models import Max
+
+        pk = self._next_pks.get(model_class)
+        if pk is None:
+            largest = model_class.objects.using(self.using).aggregate(largest=Max('pk'))['largest']
+            pk = (largest or 0) + 1
+        self._next_pks[model_class] = pk + 1
+        return model_class(pk=pk, **values)
+
+    def write(self, instances):
+        """
+        Append instances to the file, grouped by model in order of first appearance.
+        """
+        groups = defaultdict(list)
+        for instance in instances:
+            # like an insert, let fields fill their values, e.g. auto_now dates
+            for field in instance._meta.concrete_fields:
+                setattr(instance, field.attname, field.pre_save(instance, True))
+            groups[type(instance)].append(instance)
+
+        for model_class, model_instances in groups.items():
+            if self.export_format == 'json':
+                self._write_fixture(model_instances)
+            else:
+                self._write_inserts(model_class, model_instances)
+            self.rows[model_class._meta.label] += len(model_instances)
+
+    def _write_fixture(self, instances):
+        from django.core import serializers
+        from django.core.serializers.json import DjangoJSONEncoder
+
+        for entry in serializers.serialize('python', instances):
+            self._file.write(',\n' if self._has_entries else '\n')
+            self._file.write(json.dumps(entry, cls=DjangoJSONEncoder))
+            self._has_entries = True
+
+    def _write_inserts(self, model_class, instances):
+        from django.db import connections
+
+        connection = connections[self.using]
+        fields = model_class._meta.concrete_fields
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        for chunk in chunked(instances, INSERT_CHUNK_SIZE):
+            rows = ',\n'.join(
+                '({})'.format(', '.join(
+                    quote_value(self._get_db_value(connection, field, instance), connection.vendor)
+                    for field in fields
+                ))
+                for instance in chunk
+            )
+            self._file.write('INSERT INTO {} ({}) VALUES\n{};\n'.format(
+                connection.ops.quote_name(model_class._meta.db_table), columns, rows
+            ))
+
+    @staticmethod
+    def _get_db_value(connection, field, instance):
+        value = getattr(instance, field.attname)
+        if field.get_internal_type() == 'JSONField' and value is not None:
+            # some backends adapt JSON values to driver objects instead of strings
+            return json.dumps(value, cls=getattr(field, 'encoder', None))
+        return field.get_db_prep_save(value, connection)
@@ -0,0 +1,51 @@
+import fcntl
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def locked(file_path):
+    """
+    Context manager holding an exclusive lock on a lock file next to a file, so
+    that processes updating the file don't lose each other's changes.
+    """
+    with open('{}.lock'.format(file_path), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def atomic_write(file_path, mode='w', sync=False):
+    """
+    Context manager returning a temporary file to write instead of `file_path`,
+    renamed to it once complete, so readers never see a partial file. Each process
+    writes its own temporary file, which is removed if writing fails.
+
+    Args:
+        file_path (str)
+        mode (str): `w`, or `wb` for binary content
+        sync (bool): flush the content to disk before the rename
+    """
+    tmp_path = '{}.{}.tmp'.format(file_path, os.getpid())
+    try:
+        with open(tmp_path, mode) as file:
+            yield file
+            if sync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_atomically(file_path, content):
+    """
+    Write a file through a temporary file and a rename, so readers never see a partial file.
+    """
+    with atomic_write(file_path) as file:
+        file.write(content)
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+from const import FINGERPRINTS_FILE
+from files import atomic_write, locked
+
+
+logger = logging.getLogger(__name__)
+
+# bump this whenever the generated values change for the same configuration,
+# so that the next run processes every microsite again
+FINGERPRINT_VERSION = 1
+
+
+def fingerprint(*values):
+    """
+    Returns a stable hash of given JSON serializable values.
+    """
+    data = json.dumps([FINGERPRINT_VERSION, values], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def get_target():
+    """
+    Returns what identifies the database a generator applies its rows to: the django
+    settings module, and the name and host of the default database.
+    """
+    from django.conf import settings
+    from django.db import DEFAULT_DB_ALIAS
+
+    database = settings.DATABASES.get(DEFAULT_DB_ALIAS, {})
+    return '{} {}/{}'.format(settings.SETTINGS_MODULE, database.get('HOST') or '', database.get('NAME') or '')
+
+
+class Fingerprints:
+    """
+    Keeps track of the fingerprints of the planned values applied by the last
+    successful run of a service, so that unchanged microsites can be skipped.
+    Fingerprints are stored by service and target database, as rows applied to
+    one database say nothing about another one, e.g. devstack and production.
+
+    Services share the fingerprints file, so saving holds an exclusive lock on a
+    lock file next to it, and replaces the file with an atomic rename.
+    """
+
+    def __init__(self, service, full=False, path=FINGERPRINTS_FILE, partial=False, target=None):
+        """
+        Args:
+            service (str): service key
+            full (bool): select every code, regardless of stored fingerprints
+            path (str): fingerprints file path
+            partial (bool): only some codes are planned in this run, fingerprints
+                of the other codes are kept when saving
+            target (str): target database, the one django is set up with by default
+        """
+        self.service = service
+        self.full = full
+        self.path = path
+        self.partial = partial
+        self.key = '{} {}'.format(service, target or get_target())
+        self._stored = self._load().get(self.key, {})
+        self._pending = {}
+
+    def _load(self):
+        """
+        Returns the stored fingerprints of every service. An unreadable file is
+        ignored, so that every microsite is processed again.
+        """
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as error:
+            logger.warning('Ignoring fingerprints in {}: {}'.format(self.path, error))
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def select(self, group, items, compute=fingerprint):
+        """
+        Returns the planned items whose fingerprint changed since the last successful run.
+
+        Args:
+            group (str): kind of items, e.g. `microsites` or `organizations`
+            items (dict): A mapping of code and planned values
+            compute (callable): returns the fingerprint of planned values
+        Returns:
+            selected (dict): A mapping of code and planned values
+        """
+        return {code: values for code, values, changed in self.scan(group, items.items(), compute) if changed}
+
+    def scan(self, group, items, compute=fingerprint):
+        """
+        Fingerprint planned items one at a time, e.g. from a generator.
+
+        Args:
+            group (str): kind of items, e.g. `microsites` or `organizations`
+            items (iterable): (code, planned values) pairs
+            compute (callable): returns the fingerprint of planned values
+        Yields:
+            (code, values, changed): whether each item changed since the last successful run
+        """
+        stored = self._stored.get(group, {})
+        pending = self._pending.setdefault(group, {})
+
+        selected = 0
+        for code, values in items:
+            pending[code] = compute(values)
+            changed = self.full or stored.get(code) != pending[code]
+            selected += changed
+            yield code, values, changed
+
+        logger.info('{} {}: {} changed, {} unchanged'.format(
+            self.service, group, selected, len(pending) - selected
+        ))
+
+    def get_stored(self, group):
+        """
+        Returns the values of a group stored by the last successful run, by code.
+        """
+        return dict(self._stored.get(group, {}))
+
+    def record(self, group, values):
+        """
+        Store values of a group as they are when saving, e.g. what was written for each code.
+
+        Args:
+            group (str): kind of values, e.g. `ecommerce_redirect_uris`
+            values (dict): A mapping of code and JSON serializable value
+        """
+        self._pending.setdefault(group, {}).update(values)
+
+    def digest(self):
+        """
+        Returns a fingerprint of every planned item fingerprinted in this run, for its target database.
+        """
+        return fingerprint(self.key, self._pending)
+
+    def save(self):
+        """
+        Store fingerprints computed in this run. Must only be called once every
+        selected code has been applied successfully.
+        """
+        with locked(self.path):
+            # re-read the file, other services may have saved their fingerprints meanwhile
+            data = self._load()
+            stored = data.setdefault(self.key, {})
+            for group, fingerprints in self._pending.items():
+                if self.partial:
+                    stored.setdefault(group, {}).update(fingerprints)
+                else:
+                    stored[group] = fingerprints
+
+            with atomic_write(self.path) as file:
+                json.dump(data, file, sort_keys=True)
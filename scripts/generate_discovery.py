@@ -1,53 +1,48 @@
-from collections import defaultdict
-import sys
-import os
 import logging
 from const import DISCOVERY_ROOT_DIR
-from generator_utils import load_config, common_args, update_model
+from generator_utils import ServiceGenerator, run_command
+from reconcile import Reconciliation
 
 
 logger = logging.getLogger(__name__)
 
+PARTNER = 'course_discovery.apps.core.models.Partner'
 
-def create_sites(config):
+
+def build_plan(config, microsites=True):
     """
-    Create custom sites in discovery service.
+    Compile the desired state of discovery service from the configuration. Doesn't need django.
 
     Args:
         config (Config)
+        microsites (bool): whether microsites are planned too, instead of streamed with stream_plan
     Returns:
-        sites (dict): A mapping of custom site code and site instance
+        plan (dict): microsites values, by code
     """
-    from django.contrib.sites.models import Site
+    plan = {'microsites': {}}
 
-    sites = {}
-    for code in config.get_microsite_codes():
-        context = config.get_context(code)
-        site = {
-            'domain': context['discovery_domain'],
-            'name': context['discovery_domain']
-        }
-        logger.info('Creating site for {} - {}'.format(code, site))
-        site, _ = Site.objects.get_or_create(domain=site['domain'], defaults=site)
-        sites[code] = site
-    return sites
+    if microsites:
+        plan['microsites'] = dict(stream_plan(config))
+
+    return plan
 
 
-def create_partner(config, sites):
+def stream_plan(config, codes=None):
     """
-    Create Partner for each custom sites in discovery service.
+    Yields the code and planned values of each microsite, one at a time. Doesn't need django.
 
     Args:
         config (Config)
-        sites (dict)
+        codes (iterable): microsite codes, every selected microsite by default
     """
-    from course_discovery.apps.core.models import Partner
-
-    for code in config.get_microsite_codes():
+    for code in config.get_microsite_codes() if codes is None else codes:
         context = config.get_context(code)
+        site = {
+            'domain': context['discovery_domain'],
+            'name': context['discovery_domain']
+        }
         partner = {
             'name': code,
-            'site': sites[code],
             'short_code': code,
             'courses_api_url': '{}/api/courses/v1/'.format(context['lms_url']),
             'ecommerce_api_url': '{}/api/v2/'.format(context['ecommerce_url']),
@@ -56,14 +51,76 @@ def create_partner(config, sites):
             'lms_admin_url': '{}/admin'.format(context['lms_url']),
             'studio_url': context['studio_url']
         }
-        partner = config.apply_overrides(code, 'discovery', Partner, partner)
+        yield code, {
+            'site': site,
+            'partner': config.apply_overrides(code, 'discovery', PARTNER, partner),
+        }
+
+
+def create_sites(microsites):
+    """
+    Create custom sites in discovery service.
+
+    Args:
+        microsites (dict): A mapping of microsite code and planned values
+    Returns:
+        sites (dict): A mapping of custom site code and site instance
+    """
+    from django.contrib.sites.models import Site
+
+    reconciliation = Reconciliation(Site, 'domain', update=False)
+    for code, microsite in microsites.items():
+        site = microsite['site']
+        logger.info('Creating site for {} - {}'.format(code, site))
+        reconciliation.add(code, site)
+
+    reconciliation.classify()
+    return reconciliation.save()
+
+
+def create_partner(microsites, sites):
+    """
+    Create Partner for each custom sites in discovery service.
+
+    Args:
+        microsites (dict): A mapping of microsite code and planned values
+        sites (dict)
+    """
+    from course_discovery.apps.core.models import Partner
+
+    reconciliation = Reconciliation(Partner, 'site')
+    for code, microsite in microsites.items():
+        partner = dict(microsite['partner'], site=sites[code])
         logger.info('Creating partner for {} - {}'.format(code, partner))
-        partner_obj, created = Partner.objects.get_or_create(site=partner['site'], defaults=partner)
-        if not created:
-            update_model(partner_obj, **partner)
+        reconciliation.add(code, partner)
 
+    reconciliation.classify()
+    reconciliation.save()
 
-def run(config_file_path, settings_module):
+
+class DiscoveryGenerator(ServiceGenerator):
+    """
+    Generates the sites and partners of discovery service.
+    """
+
+    service = 'discovery'
+    root_dir = DISCOVERY_ROOT_DIR
+    stages = (
+        ('sites', create_sites, ()),
+        ('partners', create_partner, ('sites',)),
+    )
+    build_plan = staticmethod(build_plan)
+    stream_plan = staticmethod(stream_plan)
+
+    def export_microsite(self, export, microsite):
+        from django.contrib.sites.models import Site
+        from course_discovery.apps.core.models import Partner
+
+        site = export.create(Site, **microsite['site'])
+        return [site, export.create(Partner, site=site, **microsite['partner'])]
+
+
+def run(config_file_path, settings_module, options):
     """
     Given a configuration file path and django settings module,
     load discovery service django app and generate custom sites.
@@ -71,20 +128,10 @@ def run(config_file_path, settings_module):
     Args:
         config_file_path (str)
         settings_module (str)
+        options (Namespace): parsed command line options
     """
-    sys.path.append(DISCOVERY_ROOT_DIR)
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
-
-    import django
-    django.setup()
-
-    config = load_config(config_file_path)
-
-    sites = create_sites(config)
-    create_partner(config, sites)
+    DiscoveryGenerator(options).run(config_file_path, settings_module)
 
 
 if __name__ == '__main__':
-    parser = common_args()
-    cli_args = parser.parse_args()
-    run(cli_args.ConfigFilePath, cli_args.settings)
+    run_command('discovery', run)
@@ -1,105 +1,179 @@
-from collections import defaultdict
-import sys
-import os
 import logging
 from const import ECOMMERCE_ROOT_DIR
-from generator_utils import load_config, common_args, update_model, load_generated_values
+from generator_utils import ServiceGenerator, run_command, generated_value, resolve_generated_values
+from generated_values import SSO_KEYS, generated_store
+from reconcile import Reconciliation
 
 
 logger = logging.getLogger(__name__)
 
+SITE_CONFIGURATION = 'ecommerce.core.models.SiteConfiguration'
 
-def create_sites(config):
+
+def build_plan(config, microsites=True):
     """
-    Create custom sites in eCommerce service.
+    Compile the desired state of eCommerce service from the configuration. Doesn't need django.
+    Values shared by the LMS generator are left as placeholders, resolved when applying.
 
     Args:
         config (Config)
+        microsites (bool): whether microsites are planned too, instead of streamed with stream_plan
     Returns:
-        sites (dict): A mapping of custom site code and site instance
+        plan (dict): microsites values, by code
     """
-    from django.contrib.sites.models import Site
+    plan = {'microsites': {}}
 
-    sites = {}
-    for code in config.get_microsite_codes():
-        context = config.get_context(code)
+    if microsites:
+        plan['microsites'] = dict(stream_plan(config))
+
+    return plan
+
+
+def stream_plan(config, codes=None):
+    """
+    Yields the code and planned values of each microsite, one at a time. Doesn't need django.
 
+    Args:
+        config (Config)
+        codes (iterable): microsite codes, every selected microsite by default
+    """
+    for code in config.get_microsite_codes() if codes is None else codes:
+        context = config.get_context(code)
         site = {
             'domain': context['ecommerce_domain'],
             'name': context['ecommerce_domain']
         }
+        partner = {
+            'name': code,
+            'short_code': code,
+        }
+        site_config = {
+            'lms_url_root': context['lms_url'],
+            'discovery_api_url': context['discovery_api_url'],
+            'oauth_settings': {
+                'SOCIAL_AUTH_EDX_OAUTH2_URL_ROOT': context['lms_url'],
+                'SOCIAL_AUTH_EDX_OAUTH2_ISSUERS': [
+                    context['lms_url']
+                ],
+                'SOCIAL_AUTH_EDX_OAUTH2_LOGOUT_URL': '{}/logout'.format(context['lms_url']),
+                'SOCIAL_AUTH_EDX_OAUTH2_KEY': generated_value('SOCIAL_AUTH_EDX_OAUTH2_KEY'),
+                'SOCIAL_AUTH_EDX_OAUTH2_SECRET': generated_value('SOCIAL_AUTH_EDX_OAUTH2_SECRET'),
+            }
+        }
+        yield code, {
+            'site': site,
+            'partner': partner,
+            'site_configuration': config.apply_overrides(code, 'ecommerce', SITE_CONFIGURATION, site_config),
+        }
+
+
+def create_sites(microsites):
+    """
+    Create custom sites in eCommerce service.
+
+    Args:
+        microsites (dict): A mapping of microsite code and planned values
+    Returns:
+        sites (dict): A mapping of custom site code and site instance
+    """
+    from django.contrib.sites.models import Site
+
+    reconciliation = Reconciliation(Site, 'domain', update=False)
+    for code, microsite in microsites.items():
+        site = microsite['site']
         logger.info('Creating site for {} - {}'.format(code, site))
-        site, _ = Site.objects.get_or_create(domain=site['domain'], defaults=site)
-        sites[code] = site
-    return sites
+        reconciliation.add(code, site)
+
+    reconciliation.classify()
+    return reconciliation.save()
 
 
-def create_partner(config, sites):
+def create_partner(microsites, sites):
     """
     Create Partner for each custom sites in eCommerce service.
 
     Args:
-        config (Config)
+        microsites (dict): A mapping of microsite code and planned values
         sites (dict)
     Returns:
         partners (dict): A mapping of custom site code and partners
     """
     from ecommerce.extensions.partner.models import Partner
 
-    partners = {}
-    for code in config.get_microsite_codes():
-        partner = {
-            'name': code,
-            'default_site': sites[code],
-            'short_code': code,
-        }
+    reconciliation = Reconciliation(Partner, 'short_code')
+    for code, microsite in microsites.items():
+        partner = dict(microsite['partner'], default_site=sites[code])
         logger.info('Creating partner for {} - {}'.format(code, partner))
-        p, created = Partner.objects.get_or_create(short_code=code, defaults=partner)
-        if not created:
-            update_model(p, **partner)
-        partners[code] = p
-    return partners
+        reconciliation.add(code, partner)
+
+    reconciliation.classify()
+    return reconciliation.save()
 
 
-def create_site_configuration(config, sites, partners):
+def create_site_configuration(microsites, sites, partners):
     """
     Create Site Configuration for each custom sites in eCommerce service.
 
     Args:
-        config (Config)
+        microsites (dict): A mapping of microsite code and planned values, with the values
+            shared by the LMS generator resolved
         sites (dict)
         partners (dict)
     """
     from ecommerce.core.models import SiteConfiguration
 
-    generated_values = load_generated_values()
+    reconciliation = Reconciliation(SiteConfiguration, 'partner')
+    for code, microsite in microsites.items():
+        site_config = dict(microsite['site_configuration'], site=sites[code], partner=partners[code])
+        reconciliation.add(code, site_config)
 
-    for code in config.get_microsite_codes():
-        context = config.get_context(code)
+    reconciliation.classify()
+    reconciliation.save()
 
-        site_config = {
-            'site': sites[code],
-            'partner': partners[code],
-            'lms_url_root': context['lms_url'],
-            'discovery_api_url': context['discovery_api_url'],
-            'oauth_settings': {
-                'SOCIAL_AUTH_EDX_OAUTH2_URL_ROOT': context['lms_url'],
-                'SOCIAL_AUTH_EDX_OAUTH2_ISSUERS': [
-                    context['lms_url']
-                ],
-                'SOCIAL_AUTH_EDX_OAUTH2_LOGOUT_URL': '{}/logout'.format(context['lms_url']),
-                'SOCIAL_AUTH_EDX_OAUTH2_KEY': generated_values.get('SOCIAL_AUTH_EDX_OAUTH2_KEY'),
-                'SOCIAL_AUTH_EDX_OAUTH2_SECRET': generated_values.get('SOCIAL_AUTH_EDX_OAUTH2_SECRET'),
-            }
-        }
-
-        site_config = config.apply_overrides(code, 'ecommerce', SiteConfiguration, site_config)
-        site_config_obj, created = SiteConfiguration.objects.get_or_create(partner=partners[code], defaults=site_config)
-        if not created:
-            update_model(site_config_obj, **site_config)
 
+class EcommerceGenerator(ServiceGenerator):
+    """
+    Generates the sites, partners and site configurations of eCommerce service.
+    """
 
-def run(config_file_path, settings_module):
+    service = 'ecommerce'
+    root_dir = ECOMMERCE_ROOT_DIR
+    stages = (
+        ('sites', create_sites, ()),
+        ('partners', create_partner, ('sites',)),
+        ('site_configurations', create_site_configuration, ('sites', 'partners')),
+    )
+    site_configuration = SITE_CONFIGURATION
+    build_plan = staticmethod(build_plan)
+    stream_plan = staticmethod(stream_plan)
+
+    def __init__(self, options):
+        super().__init__(options)
+        # values shared by the LMS generator
+        self.generated_values = {}
+
+    def setup(self):
+        if self.options.wait_for_sso:
+            # the LMS generator may still be running, wait until it has shared the SSO credentials
+            self.generated_values = generated_store.wait_for(SSO_KEYS, timeout=self.options.wait_for_sso)
+        else:
+            self.generated_values = generated_store.read()
+
+    def resolve(self, values):
+        return resolve_generated_values(values, self.generated_values)
+
+    def export_microsite(self, export, microsite):
+        from django.contrib.sites.models import Site
+        from ecommerce.core.models import SiteConfiguration
+        from ecommerce.extensions.partner.models import Partner
+
+        site = export.create(Site, **microsite['site'])
+        partner = export.create(Partner, default_site=site, **microsite['partner'])
+        site_config = dict(microsite['site_configuration'], site=site, partner=partner)
+        return [site, partner, export.create(SiteConfiguration, **site_config)]
+
+
+def run(config_file_path, settings_module, options):
     """
     Given a configuration file path and django settings module,
     load eCommerce service django app and generate custom sites.
@@ -107,22 +181,10 @@ def run(config_file_path, settings_module):
     Args:
         config_file_path (str)
         settings_module (str)
+        options (Namespace): parsed command line options
     """
-
-    sys.path.append(ECOMMERCE_ROOT_DIR)
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)  # for production use lms.envs.production
-
-    import django
-    django.setup()
-
-    config = load_config(config_file_path)
-
-    sites = create_sites(config)
-    partners = create_partner(config, sites)
-    create_site_configuration(config, sites, partners)
+    EcommerceGenerator(options).run(config_file_path, settings_module)
 
 
 if __name__ == '__main__':
-    parser = common_args()
-    cli_args = parser.parse_args()
-    run(cli_args.ConfigFilePath, cli_args.settings)
+    run_command('ecommerce', run)
@@ -1,71 +1,68 @@
-from collections import defaultdict
-import sys
-import os
+from collections import Counter
 import logging
+import os
 from const import LMS_ROOT_DIR
-from generator_utils import load_config, common_args, update_model, deep_merge, write_generated_values
+from generator_utils import ServiceGenerator, run_command, instrumentation, merge_overrides
+from generated_values import RUN_ID_VARIABLE, SSO_RUN_KEY, generated_store
+from reconcile import Reconciliation, chunked, read_routing
+from fingerprints import fingerprint
 
 
 logger = logging.getLogger(__name__)
 
+SITE = 'django.contrib.sites.models.Site'
+SITE_CONFIGURATION = 'openedx.core.djangoapps.site_configuration.models.SiteConfiguration'
+
+# path of the eCommerce OAuth redirect URIs of microsites
+ECOMMERCE_REDIRECT_PATH = '/complete/edx-oauth2/'
 
-def create_organizations(config):
+# warn when redirect URIs grow larger than a MySQL TEXT column
+REDIRECT_URIS_WARNING_SIZE = 65535
+
+
+def build_plan(config, microsites=True):
     """
-    Create Organizations in LMS.
+    Compile the desired state of LMS from the configuration. Doesn't need django.
 
     Args:
         config (Config)
+        microsites (bool): whether microsites are planned too, instead of streamed with stream_plan
+    Returns:
+        plan (dict): organizations and microsites values, by code
     """
-    from common.djangoapps.util.organizations_helpers import add_organization
+    plan = {
+        'ecommerce_sso_client': config.oauth['ecommerce_sso_client'],
+        'organizations': {},
+        'microsites': {},
+    }
 
     for code in config.get_organization_codes():
-        org = {
+        plan['organizations'][code] = {
             'short_name': code,
             'name': config.get_organization_name(code)
         }
-        logger.info('Creating Organization for {} - {}'.format(code, org))
-        add_organization(org)
+
+    if microsites:
+        plan['microsites'] = dict(stream_plan(config))
+
+    return plan
 
 
-def create_sites(config):
+def stream_plan(config, codes=None):
     """
-    Create custom sites in LMS.
+    Yields the code and planned values of each microsite, one at a time. Doesn't need django.
 
     Args:
         config (Config)
-    Returns:
-        sites (dict): A mapping of custom site code and site instance
+        codes (iterable): microsite codes, every selected microsite by default
     """
-    from django.contrib.sites.models import Site
-
-    sites = {}
-    for code in config.get_microsite_codes():
+    for code in config.get_microsite_codes() if codes is None else codes:
         context = config.get_context(code)
         site = {
             'domain': context['lms_domain'],
             'name': context['lms_domain']
         }
-        site = config.apply_overrides(code, 'lms', Site, site)
-        logger.info('Creating site for {} - {}'.format(code, site))
-        site, _ = Site.objects.get_or_create(domain=site['domain'], defaults=site)
-        sites[code] = site
-    return sites
-
-
-def create_site_configurations(config, sites):
-    """
-    Create SiteConfiguration for each custom sites in LMS.
-
-    Args:
-        config (Config)
-        sites (dict)
-    """
-    from openedx.core.djangoapps.site_configuration.models import SiteConfiguration
-
-    for code in config.get_microsite_codes():
-        context = config.get_context(code)
         site_configuration = {
-            'site': sites[code],
             'enabled': True,
             'site_values': {
                 'PLATFORM_NAME': context['name'],
@@ -78,90 +75,272 @@ def create_site_configurations(config, sites):
                 'COURSE_CATALOG_API_URL': context['discovery_api_url'],
             }
         }
-        site_configuration = config.apply_overrides(code, 'lms', SiteConfiguration, site_configuration)
+        yield code, {
+            'site': config.apply_overrides(code, 'lms', SITE, site),
+            'site_configuration': config.apply_overrides(code, 'lms', SITE_CONFIGURATION, site_configuration),
+            'ecommerce_redirect_uri': '{}{}'.format(context['ecommerce_url'], ECOMMERCE_REDIRECT_PATH),
+        }
+
+
+def create_organizations(organizations, summary):
+    """
+    Create Organizations in LMS, or update the ones whose name changed.
+
+    Existing organizations are fetched by short name in one query, missing ones
+    are created in bulk and only changed ones are updated.
+
+    Args:
+        organizations (dict): A mapping of organization code and organization values
+        summary (Counter): counts of created, updated and unchanged organizations
+    """
+    from organizations.models import Organization
+
+    reconciliation = Reconciliation(Organization, 'short_name')
+    for code, org in organizations.items():
+        logger.info('Creating Organization for {} - {}'.format(code, org))
+        # like add_organization, reactivate organizations which have been deactivated
+        reconciliation.add(code, dict(org, active=True))
+
+    reconciliation.classify()
+    reconciliation.save()
+    summary.update(
+        created=reconciliation.created,
+        updated=reconciliation.updated,
+        unchanged=len(reconciliation.unchanged)
+    )
+
+
+def create_sites(microsites):
+    """
+    Create custom sites in LMS.
+
+    Args:
+        microsites (dict): A mapping of microsite code and planned values
+    Returns:
+        sites (dict): A mapping of custom site code and site instance
+    """
+    from django.contrib.sites.models import Site
+
+    reconciliation = Reconciliation(Site, 'domain', update=False)
+    for code, microsite in microsites.items():
+        site = microsite['site']
+        logger.info('Creating site for {} - {}'.format(code, site))
+        reconciliation.add(code, site)
+
+    reconciliation.classify()
+    return reconciliation.save()
+
+
+def keep_admin_edits(site_config_obj, site_configuration):
+    """
+    Merge generated site values into an existing SiteConfiguration.
+
+    Args:
+        site_config_obj (SiteConfiguration): existing site configuration
+        site_configuration (dict): generated field values
+    """
+    # while regenerating, we want to keep whatever value has been edited from django admin intact!
+    site_values = merge_overrides(site_configuration['site_values'], site_config_obj.site_values)
+    return dict(site_configuration, site_values=site_values)
+
+
+def create_site_configurations(microsites, sites):
+    """
+    Create SiteConfiguration for each custom sites in LMS.
+
+    Args:
+        microsites (dict): A mapping of microsite code and planned values
+        sites (dict)
+    """
+    from openedx.core.djangoapps.site_configuration.models import SiteConfiguration
+
+    # SiteConfigurationHistory is recorded from post_save signals, so rows are saved one by one
+    reconciliation = Reconciliation(SiteConfiguration, 'site', merge=keep_admin_edits, bulk=False)
+    for code, microsite in microsites.items():
+        site_configuration = dict(microsite['site_configuration'], site=sites[code])
         logger.info('Creating SiteConfiguration for {} - {}'.format(code, site_configuration))
-        site_config_obj, created = SiteConfiguration.objects.get_or_create(site=site_configuration['site'], defaults=site_configuration)
-        if not created:
-            # while regenerating, we want to keep whatever value has been edited from django admin intact!
-            site_values = deep_merge(
-                site_config_obj.site_values, site_configuration['site_values']
-            )
-            site_configuration['site_values'] = site_values
-            update_model(site_config_obj, **site_configuration)
+        reconciliation.add(code, site_configuration)
+
+    reconciliation.classify()
+    reconciliation.save()
 
 
-def add_ecommerce_redirect_urls(config):
+def add_ecommerce_redirect_urls(sso_client, redirect_uris, codes, prune=None):
     """
     Add eCommerce Oauth redirect url for each custom sites in LMS.
 
+    Redirect URIs are kept sorted and deduplicated, and the application is
+    only saved when they changed.
+
     Args:
-        config (Config)
+        sso_client (str): name of the eCommerce SSO application
+        redirect_uris (dict): A mapping of microsite code and redirect URI, for every planned microsite
+        codes (list): microsite codes, every microsite is added if the application is new
+        prune (iterable): redirect URIs written by previous runs, the ones which are not in the plan
+            anymore are removed. Other redirect URIs, e.g. added by hand, are always kept.
     """
     from oauth2_provider.models import Application
     from django.contrib.auth import get_user_model
 
-    redirect_uris = []
-    for code in config.get_microsite_codes():
-        context = config.get_context(code)
-        redirect_uris.append('{}/complete/edx-oauth2/'.format(context['ecommerce_url']))
-
-    ecommerce_app, created = Application.objects.get_or_create(name=config.oauth['ecommerce_sso_client'])
+    # redirect URIs are merged onto the current row, so it's read from the default database
+    # and locked until the batch commits, rather than read from a replica which may lag behind
+    ecommerce_app, created = Application.objects.select_for_update().get_or_create(name=sso_client)
 
     if created:
         ecommerce_app.client_type = 'confidential'
         ecommerce_app.authorization_grant_type = 'authorization-code'
-        ecommerce_app.user = get_user_model().objects.get(username='ecommerce_worker')
+        ecommerce_worker = read_routing.get(get_user_model(), 'username', 'ecommerce_worker')
+        if ecommerce_worker is None:
+            raise get_user_model().DoesNotExist('ecommerce_worker user does not exist')
+        ecommerce_app.user = ecommerce_worker
         ecommerce_app.skip_authorization = True
         ecommerce_app.save()
-
-    if ecommerce_app.redirect_uris:
-        redirect_uris += ecommerce_app.redirect_uris.split()
-
-    redirect_uris_str = ' '.join(set(redirect_uris))
-    logger.info('Adding ecommerce to redirect url {}'.format(redirect_uris_str))
-    ecommerce_app.redirect_uris = redirect_uris_str
-    ecommerce_app.save()
-
-
-def share_sso_credentials(config):
+        read_routing.record(Application, 'name', [sso_client])
+        codes = redirect_uris.keys()
+
+    existing = set((ecommerce_app.redirect_uris or '').split())
+    added = {redirect_uris[code] for code in codes} - existing
+
+    removed = set()
+    if prune is not None:
+        planned = set(redirect_uris.values())
+        removed = {uri for uri in prune if uri in existing and uri not in planned}
+
+    redirect_uris_str = ' '.join(sorted((existing | added) - removed))
+    size = len(redirect_uris_str.encode('utf-8'))
+    logger.info('eCommerce redirect uris: {} added, {} removed, {} total, {} bytes'.format(
+        len(added), len(removed), len(existing) + len(added) - len(removed), size
+    ))
+    if size > REDIRECT_URIS_WARNING_SIZE:
+        logger.warning('eCommerce redirect uris are larger than {} bytes, check the size of the column'.format(
+            REDIRECT_URIS_WARNING_SIZE
+        ))
+
+    if redirect_uris_str != ecommerce_app.redirect_uris:
+        ecommerce_app.redirect_uris = redirect_uris_str
+        ecommerce_app.save(update_fields=['redirect_uris'])
+        read_routing.record(Application, 'name', [sso_client])
+
+
+def share_sso_credentials(plan):
     """
     Writes OAuth client credentials in the shared generated config file.
     """
     from oauth2_provider.models import Application
 
-    ecommerce_sso = Application.objects.get(name=config.oauth['ecommerce_sso_client'])
+    ecommerce_sso = read_routing.get(Application, 'name', plan['ecommerce_sso_client'])
+    if ecommerce_sso is None:
+        raise Application.DoesNotExist('{} application does not exist'.format(plan['ecommerce_sso_client']))
 
-    write_generated_values({
+    values = {
         'SOCIAL_AUTH_EDX_OAUTH2_KEY': ecommerce_sso.client_id,
         'SOCIAL_AUTH_EDX_OAUTH2_SECRET': ecommerce_sso.client_secret,
-    })
+    }
+    run_id = os.environ.get(RUN_ID_VARIABLE)
+    if run_id:
+        # unchanged credentials are not written again, mark them as shared by this run
+        values[SSO_RUN_KEY] = run_id
+    generated_store.update(values)
 
 
-def run(config_file_path, settings_module):
+def organizations_enabled():
+    """
+    Whether the organizations app is enabled in LMS.
+    """
+    from common.djangoapps.util.organizations_helpers import organizations_enabled as enabled
+    return enabled()
+
+
+class LmsGenerator(ServiceGenerator):
+    """
+    Generates the organizations, sites and site configurations of LMS, and the
+    eCommerce SSO application shared by every microsite.
+    """
+
+    service = 'lms'
+    root_dir = LMS_ROOT_DIR
+    stages = (
+        ('sites', create_sites, ()),
+        ('site_configurations', create_site_configurations, ('sites',)),
+    )
+    site_configuration = SITE_CONFIGURATION
+    build_plan = staticmethod(build_plan)
+    stream_plan = staticmethod(stream_plan)
+
+    def __init__(self, options):
+        super().__init__(options)
+        # organizations whose planned values changed
+        self.organizations = {}
+        # A mapping of microsite code and eCommerce redirect URI, for every planned microsite
+        self.redirect_uris = {}
+        # redirect URIs written by the generator, by microsite code, only these are ever pruned
+        self.written_uris = {}
+
+    def planned(self, code, values):
+        self.redirect_uris[code] = values['ecommerce_redirect_uri']
+
+    def select_shared(self, plan, fingerprints):
+        self.organizations = fingerprints.select('organizations', plan['organizations'], fingerprint)
+        self.written_uris = fingerprints.get_stored('ecommerce_redirect_uris')
+        if not self.options.prune_redirect_uris:
+            # URIs of removed microsites are kept in the application, and recorded until pruned
+            fingerprints.record('ecommerce_redirect_uris', self.written_uris)
+        fingerprints.record('ecommerce_redirect_uris', self.redirect_uris)
+
+    def write_shared(self, plan, changed, runner, journal):
+        if organizations_enabled():
+            summary = Counter(created=0, updated=0, unchanged=len(plan['organizations']) - len(self.organizations))
+            runner.run('organizations', self.organizations, lambda batch: create_organizations(batch, summary))
+            logger.info('Organizations: {created} created, {updated} updated, {unchanged} unchanged'.format(**summary))
+        else:
+            logger.info('Organizations app is not enabled, skipping organizations')
+
+        # the eCommerce SSO application is shared by every microsite, it's only updated here.
+        # Credentials are shared as early as possible, so that the eCommerce generator can start.
+        if not journal.is_completed('ecommerce_redirect_urls'):
+            with runner.batch('ecommerce_redirect_urls'):
+                add_ecommerce_redirect_urls(
+                    plan['ecommerce_sso_client'], self.redirect_uris, changed,
+                    prune=self.written_uris.values() if self.options.prune_redirect_uris else None
+                )
+            journal.record('ecommerce_redirect_urls')
+        # only needed for the application, don't keep them while writing microsites
+        self.redirect_uris = self.written_uris = None
+        with instrumentation.stage('share_sso_credentials'):
+            share_sso_credentials(plan)
+
+    def export_shared(self, plan, export):
+        from organizations.models import Organization
+
+        if not organizations_enabled():
+            return
+        for batch in chunked(plan['organizations'].values(), self.options.batch_size):
+            existing = export.existing(Organization, 'short_name', [org['short_name'] for org in batch])
+            export.write([
+                export.create(Organization, **dict(org, active=True))
+                for org in batch if org['short_name'] not in existing
+            ])
+
+    def export_microsite(self, export, microsite):
+        from django.contrib.sites.models import Site
+        from openedx.core.djangoapps.site_configuration.models import SiteConfiguration
+
+        site = export.create(Site, **microsite['site'])
+        return [site, export.create(SiteConfiguration, site=site, **microsite['site_configuration'])]
+
+
+def run(config_file_path, settings_module, options):
     """
     Given a configuration file path and django settings module,
-    load eCommerce service django app and generate custom sites.
+    load LMS django app and generate custom sites.
 
     Args:
         config_file_path (str)
-        settings_module (str)
+        settings_module (str): e.g. lms.envs.production
+        options (Namespace): parsed command line options
     """
-    sys.path.append(LMS_ROOT_DIR)
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)  # for production use lms.envs.production
-
-    import django
-    django.setup()
-
-    config = load_config(config_file_path)
-
-    create_organizations(config)
-    sites = create_sites(config)
-    create_site_configurations(config, sites)
-    add_ecommerce_redirect_urls(config)
-    share_sso_credentials(config)
+    LmsGenerator(options).run(config_file_path, settings_module)
 
 
 if __name__ == '__main__':
-    parser = common_args()
-    cli_args = parser.parse_args()
-    run(cli_args.ConfigFilePath, cli_args.settings)
+    run_command('lms', run)
@@ -0,0 +1,110 @@
+import os
+import time
+import yaml
+from const import GENERATED_SHARED_CONFIG_FILE
+from files import atomic_write, locked
+from generator_utils import YamlDumper, YamlLoader
+
+
+# seconds between two reads while waiting for generated values
+WAIT_INTERVAL = 0.5
+
+# generated values eCommerce needs from the LMS generator
+SSO_KEYS = ('SOCIAL_AUTH_EDX_OAUTH2_KEY', 'SOCIAL_AUTH_EDX_OAUTH2_SECRET')
+
+# generated value holding the orchestrated run which last shared the SSO credentials
+SSO_RUN_KEY = 'SSO_CREDENTIALS_RUN'
+
+# environment variable identifying an orchestrated run, set for every generator it starts
+RUN_ID_VARIABLE = 'MICROSITE_GENERATOR_RUN_ID'
+
+
+class GeneratedValues:
+    """
+    Values shared between service generators, e.g. the eCommerce SSO credentials
+    written by the LMS generator.
+
+    Writers hold an exclusive lock on a lock file next to the values file, and
+    replace the values file with an atomic rename, so concurrent writers don't
+    lose each other's values and readers never see a half written file.
+    """
+
+    def __init__(self, path=GENERATED_SHARED_CONFIG_FILE):
+        """
+        Args:
+            path (str): generated values file path
+        """
+        self.path = path
+        # last values read, with the version of the file they were read from
+        self._cache = (None, {})
+
+    def _version(self):
+        """
+        Returns what identifies the current content of the file, None if it doesn't exist.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        # a renamed file gets a new inode, even if written within the mtime resolution
+        return stat.st_mtime_ns, stat.st_ino
+
+    def read(self):
+        """
+        Returns every generated value. The file is only parsed again when it has been replaced.
+        """
+        version = self._version()
+        if version is None:
+            return {}
+
+        if self._cache[0] != version:
+            with open(self.path, 'rb') as file:
+                self._cache = (version, yaml.load(file, Loader=YamlLoader) or {})
+        return dict(self._cache[1])
+
+    def get(self, key, default=None):
+        """
+        Returns a single generated value.
+        """
+        return self.read().get(key, default)
+
+    def update(self, values):
+        """
+        Add or replace generated values, keeping the other ones. The file is
+        not written when every value is already up to date, so that watchers of
+        the file are only notified of actual changes.
+        """
+        with locked(self.path):
+            current = self.read()
+            if all(current.get(key) == value for key, value in values.items()):
+                return
+            current.update(values)
+
+            with atomic_write(self.path, sync=True) as file:
+                yaml.dump(current, file, Dumper=YamlDumper)
+            self._cache = (self._version(), current)
+
+    def wait_for(self, keys, timeout=None):
+        """
+        Block until every key has a value.
+
+        Args:
+            keys (iterable): generated value keys, e.g. `SOCIAL_AUTH_EDX_OAUTH2_KEY`
+            timeout (float): seconds to wait at most, forever if None
+        Returns:
+            values (dict): every generated value
+        Raises:
+            TimeoutError: if the keys did not appear in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            values = self.read()
+            if all(values.get(key) for key in keys):
+                return values
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError('{} did not appear in {} within {}s'.format(', '.join(keys), self.path, timeout))
+            time.sleep(WAIT_INTERVAL)
+
+
+# store of the shared generated config file
+generated_store = GeneratedValues()
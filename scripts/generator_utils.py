@@ -1,7 +1,47 @@
-import yaml
+import cProfile
+import fnmatch
+import hashlib
+import logging
 import os
+import pickle
+import re
+import sys
+import yaml
+from collections.abc import Mapping
+from functools import partial
 from argparse import ArgumentParser
-from const import GENERATED_SHARED_CONFIG_FILE
+from const import CONFIG_CACHE_DIR, GENERATED_SHARED_CONFIG_FILE
+from batching import DEFAULT_BATCH_SIZE, BatchRunner
+from reconcile import chunked, read_routing
+from instrumentation import instrumentation
+from validation import check_config
+from export import EXPORT_FORMATS, Export
+from daemon import watch
+from files import atomic_write
+from fingerprints import Fingerprints, fingerprint
+from journal import Journal
+from site_cache import refresh_site_caches
+
+
+logger = logging.getLogger(__name__)
+
+# use libyaml bindings when they are available, they are much faster than the pure python ones
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# bump this whenever Config changes, so that cached configurations are parsed again
+CONFIG_CACHE_VERSION = 4
+
+# path of the LMS SiteConfiguration model in overrides
+LMS_SITE_CONFIGURATION = 'openedx.core.djangoapps.site_configuration.models.SiteConfiguration'
+
+# default LMS OAuth clients
+DEFAULT_OAUTH = {
+    'ecommerce_sso_client': 'custom-sites-ecommerce-sso',
+}
+
+# file of a configuration directory holding main settings and global overrides
+GLOBALS_FRAGMENT = '$.yaml'
 
 
 def common_args() -> ArgumentParser:
@@ -9,166 +49,884 @@ def common_args() -> ArgumentParser:
     Common argument parser for each script
     """
     parser = ArgumentParser()
-    parser.add_argument("ConfigFilePath", metavar='config_file_path', type=str, help="Configuration data file path.")
+    parser.add_argument(
+        "ConfigFilePath", metavar='config_file_path', type=str, nargs='?', help="Configuration data file path."
+    )
     parser.add_argument("--settings", type=str, required=False, help="Settings module")
+    parser.add_argument(
+        "--plan", type=str, default=None, help="Apply a plan compiled by plan.py, instead of the configuration file."
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Number of microsites written per transaction."
+    )
+    parser.add_argument("--pause", type=float, default=0, help="Seconds to sleep between two batches.")
+    parser.add_argument(
+        "--max-writes-per-second", type=float, default=None, help="Limit the rate of rows written to the database."
+    )
+    parser.add_argument(
+        "--read-db",
+        type=str,
+        default=None,
+        help="Database alias, e.g. a replica, of existence checks and state comparisons. Writes use 'default'."
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="Process every microsite, even if its configuration did not change."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip the work committed by the last run of the service, if it was interrupted."
+    )
+    parser.add_argument(
+        "--no-config-cache", dest="config_cache", action="store_false", help="Always parse the configuration file."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Number of processes the microsites are sharded between."
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write each batch of microsites through every stage, without holding the whole plan in memory."
+    )
+    parser.add_argument(
+        "--export",
+        type=str,
+        default=None,
+        help="Write the rows of missing organizations and microsites to this file, instead of the database."
+    )
+    parser.add_argument(
+        "--export-format",
+        choices=EXPORT_FORMATS,
+        default="json",
+        help="Format of --export: a django fixture for loaddata, or INSERT statements for the database client."
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running, and apply changed microsites whenever the configuration or generated values change."
+    )
+    parser.add_argument(
+        "--prune-redirect-uris",
+        action="store_true",
+        help="LMS only. Remove eCommerce redirect URIs of microsites which are not configured anymore."
+    )
+    parser.add_argument(
+        "--wait-for-sso",
+        type=float,
+        default=0,
+        help="eCommerce only. Seconds to wait for the LMS generator to share the SSO credentials."
+    )
+    parser.add_argument(
+        "--only",
+        type=code_list,
+        action="extend",
+        default=[],
+        help="Comma separated organization and microsite codes or glob patterns to process, e.g. 'A,org-*'."
+    )
+    parser.add_argument(
+        "--exclude",
+        type=code_list,
+        action="extend",
+        default=[],
+        help="Comma separated organization and microsite codes or glob patterns to skip."
+    )
+    parser.add_argument(
+        "--site-cache-key",
+        type=str,
+        default=None,
+        help="Cache key template of sites, e.g. 'site.{domain}', invalidated for changed sites."
+    )
+    parser.add_argument(
+        "--site-configuration-cache-key",
+        type=str,
+        default=None,
+        help="Cache key template of site configurations, e.g. 'site_configuration.{site_id}'."
+    )
+    parser.add_argument(
+        "--warm-site-caches",
+        action="store_true",
+        help="Write fresh cache entries of changed sites, not only delete them."
+    )
+    parser.add_argument("--cache-alias", type=str, default="default", help="Django cache of the site cache keys.")
+    parser.add_argument(
+        "--report", type=str, default=None, help="Write a JSON report of time, queries and rows of each stage."
+    )
+    parser.add_argument(
+        "--prometheus-textfile", type=str, default=None, help="Write stage metrics in the prometheus text format."
+    )
+    parser.add_argument("--profile", type=str, default=None, help="Write a cProfile dump of the whole run.")
     return parser
 
 
-def update_model(model, **kwargs):
+def run_command(service, run):
     """
-    Helper function for updaing a django model
+    Parse command line options and call `run(config_file_path, settings_module, options)`
+    of a service generator, then write the requested reports, even if the run failed.
+
     Args:
-        model: Django Model
-        kwargs: Keyword args for each field values
+        service (str): `lms`, `discovery` or `ecommerce`
+        run (callable): run function of the service generator
     """
-    for attr, val in kwargs.items():
-        setattr(model, attr, val)
-    model.save()
+    parser = common_args()
+    cli_args = parser.parse_args()
+    if not (cli_args.ConfigFilePath or cli_args.plan):
+        parser.error('config_file_path or --plan is required')
+    if (cli_args.stream or cli_args.export) and cli_args.workers > 1:
+        parser.error('--stream and --export run in a single process, they can not be used with --workers')
+    if cli_args.prune_redirect_uris and (cli_args.only or cli_args.exclude):
+        parser.error('--prune-redirect-uris needs every microsite, it can not be used with --only or --exclude')
+    if cli_args.watch and cli_args.export:
+        parser.error('--export writes a file once, it can not be used with --watch')
 
+    if cli_args.watch:
+        run = partial(run_daemon, service, run)
+    read_routing.alias = cli_args.read_db
 
-def deep_merge(source, destination):
+    profiler = cProfile.Profile() if cli_args.profile else None
+    try:
+        if profiler:
+            profiler.runcall(run, cli_args.ConfigFilePath, cli_args.settings, cli_args)
+        else:
+            run(cli_args.ConfigFilePath, cli_args.settings, cli_args)
+    finally:
+        if profiler:
+            profiler.dump_stats(cli_args.profile)
+        write_reports(service, cli_args)
+
+
+def write_reports(service, options):
+    """
+    Write the reports requested by command line options.
+    """
+    if options.report:
+        instrumentation.write_json(options.report, service)
+    if options.prometheus_textfile:
+        instrumentation.write_prometheus(options.prometheus_textfile, service)
+
+
+def run_daemon(service, run, config_file_path, settings_module, options):
     """
-    helper function to merge two dictionaries
+    Keep a service generator running with django loaded, and run it again whenever
+    the configuration (or plan) or the generated values file changes.
+
+    Each run only applies the microsites whose planned values changed since the last
+    applied state, as recorded by fingerprints. Fragments of a configuration directory
+    are only parsed again when they changed. A failed run is logged, and retried on the
+    next change. Reports are written after every run.
+
+    Args:
+        service (str): `lms`, `discovery` or `ecommerce`
+        run (callable): run function of the service generator
+        config_file_path (str)
+        settings_module (str)
+        options (Namespace): parsed command line options
     """
-    for key, value in source.items():
-        if isinstance(value, dict):
-            # get node or create one
-            node = destination.setdefault(key, {})
-            deep_merge(value, node)
+    FragmentConfig.parsed_fragments = {}
+
+    def apply():
+        instrumentation.reset()
+        # the database may have dropped connections left idle since the last run
+        close_old_connections()
+        try:
+            run(config_file_path, settings_module, options)
+        except Exception:
+            logger.exception('{} run failed, waiting for the next change'.format(service))
         else:
-            destination[key] = value
+            # the next runs only apply what changed since this one
+            options.full = options.resume = False
+        finally:
+            close_old_connections()
+        write_reports(service, options)
 
-    return destination
+    watch([options.plan or config_file_path, GENERATED_SHARED_CONFIG_FILE], apply)
 
 
-class Config:
+def call_stage(handler, dependencies, rows, microsites):
     """
-    Configuration generation helper class
+    Call the handler of a stage with a batch of microsites, then the rows written by
+    the stages it depends on.
     """
+    return handler(microsites, *(rows[dependency] for dependency in dependencies))
 
-    microsites = {}
 
-    organizations = {}
+def process_microsites(stages, microsites, runner):
+    """
+    Write the rows of given microsites stage by stage, each stage in batches.
 
-    # main domain to work with
-    main_domain = None
+    Args:
+        stages (tuple): (stage, handler, dependencies) of a service generator
+        microsites (dict): A mapping of microsite code and planned values
+        runner (BatchRunner)
+    """
+    rows = {}
+    for stage, handler, dependencies in stages:
+        # rows used by the next stages are looked up again for microsites completed by a resumed run
+        needed = any(stage in later for _, _, later in stages)
+        rows[stage] = runner.run(
+            stage, microsites, partial(call_stage, handler, dependencies, rows), skip_completed=not needed
+        )
 
-    # LMS OAuth clients
-    oauth = {
-        'ecommerce_sso_client': 'custom-sites-ecommerce-sso',
-    }
 
-    # stores global override values
-    global_overrides = {
-        'overrides': {},
-        'context_overrides': {},
-    }
+def process_batch(stages, microsites):
+    """
+    Write every stage of a batch of microsites, in the current transaction.
 
-    def __init__(self, config):
+    Args:
+        stages (tuple): (stage, handler, dependencies) of a service generator
+        microsites (dict): A mapping of microsite code and planned values
+    """
+    rows = {}
+    for stage, handler, dependencies in stages:
+        with instrumentation.stage(stage):
+            rows[stage] = call_stage(handler, dependencies, rows, microsites)
+
+
+class ServiceGenerator:
+    """
+    Run of a service generator. The plan is loaded, or built from the configuration,
+    then the microsites whose planned values changed are written stage by stage:
+    streamed, sharded between worker processes or in this process. Caches of the
+    sites that changed are refreshed. With `--export`, missing rows are written to
+    a file instead.
+
+    Services set the class attributes, and override the hooks they need.
+    """
+
+    # `lms`, `discovery` or `ecommerce`
+    service = None
+    # service root directory
+    root_dir = None
+    # (stage, handler, dependencies) writing the rows of microsites, in order. Handlers are called
+    # with a batch of microsites, then the rows written by the stages they depend on, by code.
+    stages = ()
+    # dotted path of the service SiteConfiguration model, None if the service has none
+    site_configuration = None
+    # `build_plan(config, microsites=True)` and `stream_plan(config, codes=None)` functions of the service
+    build_plan = None
+    stream_plan = None
+
+    def __init__(self, options):
         """
-        Initialize Config class
+        Args:
+            options (Namespace): parsed command line options
         """
-        self._config = config
-        self.organizations = config['organizations']
-        self.main_domain = config['main_domain']
+        self.options = options
+        self.selector = CodeSelector.from_options(options)
+
+    def setup(self):
+        """
+        Hook called once django is set up.
+        """
+
+    def resolve(self, values):
+        """
+        Returns planned values of a microsite, as written to the database.
+        """
+        return values
+
+    def fingerprint(self, values):
+        """
+        Returns the fingerprint of planned values of a microsite.
+        """
+        return fingerprint(self.resolve(values))
+
+    def planned(self, code, values):
+        """
+        Hook called with every planned microsite, changed or not, while fingerprinting.
+        """
+
+    def select_shared(self, plan, fingerprints):
+        """
+        Hook selecting the changed rows shared by microsites, once every microsite is fingerprinted.
+        """
+
+    def write_shared(self, plan, changed, runner, journal):
+        """
+        Hook writing the rows shared by microsites, before the microsites.
+
+        Args:
+            plan (dict): plan of the service
+            changed (iterable): codes of the microsites whose planned values changed
+            runner (BatchRunner)
+            journal (Journal)
+        """
+
+    def export_shared(self, plan, export):
+        """
+        Hook exporting the missing rows shared by microsites, before the microsites.
+        """
+
+    def export_microsite(self, export, microsite):
+        """
+        Returns the unsaved instances of a microsite to export.
+
+        Args:
+            export (Export)
+            microsite (dict): planned values, resolved
+        """
+        raise NotImplementedError
+
+    def run(self, config_file_path, settings_module):
+        """
+        Given a configuration file path and django settings module, load the service
+        django app and generate custom sites.
+        """
+        # imported here, as they import this module
+        from plan import iter_microsites, load_plan
+        from sharding import run_sharded
+
+        options = self.options
+        # microsites are planned one at a time, instead of all at once
+        streamed = options.stream or bool(options.export)
+        if options.plan:
+            with instrumentation.stage('load_plan'):
+                plan = load_plan(options.plan, self.service, self.selector)
+            source = partial(iter_microsites, plan)
+        else:
+            with instrumentation.stage('load_config'):
+                config = load_config(
+                    config_file_path, resolve_contexts='transient' if streamed else 'eager',
+                    cache=options.config_cache
+                )
+                config.select(self.selector)
+            with instrumentation.stage('build_plan'):
+                plan = self.build_plan(config, microsites=not streamed)
+            source = partial(self.stream_plan, config)
+
+        setup_django(self.root_dir, settings_module)
+        self.setup()
+
+        if options.export:
+            with instrumentation.stage('export'):
+                self.export_rows(plan, source())
+            return
+
+        with instrumentation.stage('fingerprints'):
+            fingerprints = Fingerprints(self.service, full=options.full, partial=bool(self.selector))
+            # streamed microsites are planned twice, only the codes of changed ones are kept
+            changed = []
+            for code, values, is_changed in fingerprints.scan(
+                'microsites', source() if options.stream else plan['microsites'].items(), self.fingerprint
+            ):
+                self.planned(code, values)
+                if is_changed:
+                    changed.append(code)
+            self.select_shared(plan, fingerprints)
+        journal = Journal(self.service, fingerprints.digest(), resume=options.resume)
+        runner = BatchRunner.from_options(options, journal)
+
+        self.write_shared(plan, changed, runner, journal)
 
-        self.oauth = config.get(
-            'oauth',
-            self.oauth
+        if options.stream:
+            runner.stream(
+                'microsites', ((code, self.resolve(values)) for code, values in source(changed)), self.stream_batch
+            )
+        else:
+            microsites = {code: self.resolve(plan['microsites'][code]) for code in changed}
+            if options.workers > 1:
+                runner.reports += run_sharded(
+                    partial(process_microsites, self.stages), microsites, options, self.root_dir, settings_module,
+                    journal
+                )
+            else:
+                process_microsites(self.stages, microsites, runner)
+            with instrumentation.stage('site_caches'):
+                self.refresh_changed_site_caches(plan['microsites'])
+        runner.summary()
+        fingerprints.save()
+        journal.clear()
+
+    def refresh_changed_site_caches(self, microsites):
+        """
+        Refresh cached entries of the sites that changed among given microsites.
+        """
+        changed = instrumentation.get_changed_codes([stage for stage, _, _ in self.stages], microsites)
+        refresh_site_caches(
+            [microsites[code]['site']['domain'] for code in changed], self.options, self.site_configuration
         )
 
+    def stream_batch(self, microsites):
+        """
+        Write a batch of streamed microsites, their site caches are refreshed once the batch is committed.
+        """
+        from django.db import transaction
+
+        process_batch(self.stages, microsites)
+        transaction.on_commit(lambda: self.refresh_changed_site_caches(microsites))
+
+    def export_rows(self, plan, microsites):
+        """
+        Write the rows missing from the service to the `--export` file, instead of the
+        database. Microsites whose site already exists are left to a regular run.
+
+        Args:
+            plan (dict): plan of the service
+            microsites (iterable): (code, planned values) pairs
+        """
+        from django.contrib.sites.models import Site
+
+        with Export(self.options.export, self.options.export_format) as export:
+            self.export_shared(plan, export)
+            for batch in chunked(microsites, self.options.batch_size):
+                existing = export.existing(Site, 'domain', [microsite['site']['domain'] for _, microsite in batch])
+                instances = []
+                for code, microsite in batch:
+                    if microsite['site']['domain'] in existing:
+                        logger.info('Site of {} already exists, skipping it'.format(code))
+                        continue
+                    instances += self.export_microsite(export, self.resolve(microsite))
+                export.write(instances)
+
+
+def code_list(value):
+    """
+    Argument type of comma separated codes.
+    """
+    return [code.strip() for code in value.split(',') if code.strip()]
+
+
+class CodeSelector:
+    """
+    Selects organization and microsite codes with lists of codes and glob patterns.
+    Plain codes are looked up in the code index, patterns are compiled into a
+    single regular expression.
+    """
+
+    __slots__ = ('only_codes', 'only_pattern', 'exclude_codes', 'exclude_pattern')
+
+    def __init__(self, only=(), exclude=()):
+        """
+        Args:
+            only (list): codes or patterns to select, every code if empty
+            exclude (list): codes or patterns to leave out
+        """
+        self.only_codes, self.only_pattern = self._compile(only)
+        self.exclude_codes, self.exclude_pattern = self._compile(exclude)
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        Create a selector from parsed command line options.
+        """
+        return cls(options.only, options.exclude)
+
+    @staticmethod
+    def _compile(selectors):
+        codes = {}
+        patterns = []
+        for selector in selectors:
+            if any(char in selector for char in '*?['):
+                patterns.append(fnmatch.translate(selector))
+            else:
+                codes[selector] = None
+        return codes, re.compile('|'.join(patterns)) if patterns else None
+
+    def __bool__(self):
+        return bool(self.only_codes or self.only_pattern or self.exclude_codes or self.exclude_pattern)
+
+    def matches(self, code):
+        """
+        Whether a code is selected.
+        """
+        if code in self.exclude_codes or (self.exclude_pattern and self.exclude_pattern.match(code)):
+            return False
+        if not (self.only_codes or self.only_pattern):
+            return True
+        return code in self.only_codes or bool(self.only_pattern and self.only_pattern.match(code))
+
+    def select(self, index):
+        """
+        Returns the selected codes of an index.
+
+        Args:
+            index (dict|KeysView): every known code
+        Returns:
+            codes (list)
+        """
+        if self.only_codes and not self.only_pattern:
+            # only look the given codes up, instead of scanning the whole index
+            return [code for code in self.only_codes if code in index and self.matches(code)]
+        return [code for code in index if self.matches(code)]
+
+    def filter(self, items):
+        """
+        Returns the selected items of a mapping of code and values.
+        """
+        return {code: items[code] for code in self.select(items)}
+
+
+def setup_django(root_dir, settings_module):
+    """
+    Make a service importable and set its django app up.
+
+    Args:
+        root_dir (str): service root directory
+        settings_module (str): django settings module
+    """
+    import django
+    from django.apps import apps
+
+    if apps.ready:
+        # already set up by a previous run of the daemon mode
+        return
+
+    sys.path.append(root_dir)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+    with instrumentation.stage('django_setup'):
+        django.setup()
+
+
+def close_old_connections():
+    """
+    Close unusable or expired database connections, once django is set up.
+    """
+    from django.apps import apps
+
+    if apps.ready:
+        from django.db import close_old_connections as close_connections
+        close_connections()
+
+
+def generated_value(key):
+    """
+    Placeholder for a value shared by another service generator, e.g. the
+    eCommerce SSO credentials. Resolved with resolve_generated_values when applying.
+    """
+    return {'$generated': key}
+
+
+def resolve_generated_values(data, values):
+    """
+    Returns a copy of data with generated_value placeholders replaced by given values.
+    """
+    if isinstance(data, dict):
+        if set(data) == {'$generated'}:
+            return values.get(data['$generated'])
+        return {key: resolve_generated_values(value, values) for key, value in data.items()}
+    if isinstance(data, list):
+        return [resolve_generated_values(value, values) for value in data]
+    return data
+
+
+def merge_overrides(data, overrides):
+    """
+    Returns a copy of `data` with `overrides` deep merged on top of it.
+
+    Neither argument is modified. Only the dictionaries along overridden paths
+    are copied, everything else is shared with the arguments and must be
+    treated as read-only.
+    """
+    result = dict(data)
+    for key, value in overrides.items():
+        current = result.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            result[key] = merge_overrides(current, value)
+        else:
+            result[key] = value
+    return result
+
+
+def get_model_path(model_class):
+    """
+    Returns the dotted path used in overrides for a django model class or path.
+    """
+    if isinstance(model_class, str):
+        return model_class
+    return '{}.{}'.format(model_class.__module__, model_class.__name__)
+
+
+class OverrideTemplate:
+    """
+    Overrides shared by every microsite, holding the microsite code at a given path.
+    Overrides of a code are only built when they are applied.
+    """
+
+    __slots__ = ('path',)
+
+    def __init__(self, path):
+        """
+        Args:
+            path (tuple): keys leading to the code, e.g. `('site_values', 'course_org_filter')`
+        """
+        self.path = path
+
+    def render(self, code):
+        overrides = code
+        for key in reversed(self.path):
+            overrides = {key: overrides}
+        return overrides
+
+
+class MergePlan:
+    """
+    Global and site specific overrides of a single service model, compiled once
+    when the configuration is loaded.
+    """
+
+    __slots__ = ('global_overrides', 'site_overrides', 'template')
+
+    def __init__(self):
+        self.global_overrides = None
+        # A mapping of microsite code and site specific overrides
+        self.site_overrides = {}
+        # OverrideTemplate of every microsite, taking precedence over its site specific overrides
+        self.template = None
+
+    def apply(self, code, data):
+        """
+        Returns a copy of data with the overrides merged in. Planned values take
+        precedence over global overrides, which take precedence over templated,
+        then other site specific overrides.
+        """
+        overrides = self.site_overrides.get(code)
+        if self.template is not None:
+            overrides = merge_overrides(overrides or {}, self.template.render(code))
+        if self.global_overrides:
+            overrides = merge_overrides(overrides, self.global_overrides) if overrides else self.global_overrides
+
+        if not overrides:
+            return data
+        return merge_overrides(overrides, data)
+
+
+def intern(value):
+    """
+    Returns the interned copy of a string, so that equal codes and names share one
+    object. Other values, e.g. a YAML name like `1337`, are returned unchanged.
+    """
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Microsite:
+    """
+    Name and site specific overrides of a microsite.
+    """
+
+    __slots__ = ('name', 'overrides', 'context_overrides')
+
+    def __init__(self, name, overrides=None, context_overrides=None):
+        """
+        Args:
+            name (str)
+            overrides (dict): site specific overrides by service and model path, if any
+            context_overrides (dict): site specific context values, if any
+        """
+        self.name = name
+        self.overrides = overrides
+        self.context_overrides = context_overrides
+
+    @classmethod
+    def from_config(cls, name, microsite=None):
+        """
+        Create a record from the name and the `microsites` entry of a microsite.
+        """
+        microsite = microsite or {}
+        return cls(
+            intern(name),
+            microsite.get('overrides') or None,
+            microsite.get('context_overrides') or None,
+        )
+
+
+class Context(Mapping):
+    """
+    Immutable resolved context of a microsite.
+
+    Values are kept in a tuple, and the key index is shared between every
+    context having the same keys, so a context costs little more than its values.
+    """
+
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        """
+        Args:
+            index (dict): A mapping of key and position in values
+            values (tuple)
+        """
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class Config:
+    """
+    Configuration generation helper class
+
+    Microsites are kept as slotted Microsite records, and codes and names are
+    interned. With `site_for_each_organization`, the generated `course_org_filter`
+    override is a single OverrideTemplate instead of a dictionary per microsite.
+    """
+
+    # CodeSelector restricting organization and microsite codes
+    selector = None
+
+    def __init__(self, config, resolve_contexts='eager'):
+        """
+        Initialize Config class
+
+        Args:
+            config (dict): parsed configuration file
+            resolve_contexts (str): `eager` resolves the context of every microsite
+                while loading, `lazy` resolves each one on first use, and `transient`
+                resolves it on every use without keeping it, for streaming
+        """
+        self._keep_contexts = resolve_contexts != 'transient'
+
+        # A mapping of microsite code and Microsite
+        self.microsites = {}
+        self.global_overrides = {
+            'overrides': {},
+            'context_overrides': {},
+        }
+
+        # A mapping of organization code and name
+        self.organizations = {
+            intern(code): intern(organization['name'])
+            for code, organization in (config['organizations'] or {}).items()
+        }
+        self.main_domain = config['main_domain']
+        self.oauth = config.get('oauth', dict(DEFAULT_OAUTH))
+        self.site_for_each_organization = config.get('site_for_each_organization', False)
+
         self._extract_microsites(config)
         self._extract_overrides(config)
+        self._compile_merge_plans()
+
+        # resolved contexts by microsite code, and shared key indexes by key tuple
+        self._contexts = {}
+        self._context_indexes = {}
+        if resolve_contexts == 'eager':
+            for code in self.microsites:
+                self._contexts[code] = self._resolve_context(code)
 
     def _extract_overrides(self, config):
         """
-        A helper method to prepare self.overrides from given config.
+        A helper method to prepare self.global_overrides from given config.
         """
-        if config['microsites']:
-            for key, val in config['microsites'].items():
-                 # $ is a special key and used for global overrides
-                if key == '$':
-                    self.global_overrides.update(val)
-                    continue
+        # $ is a special key and used for global overrides
+        if config['microsites'] and '$' in config['microsites']:
+            self.global_overrides.update(config['microsites']['$'])
+
+    def _compile_merge_plans(self):
+        """
+        Group global and site specific overrides by (service, model path).
+        """
+        self._merge_plans = {}
+
+        for service, models in (self.global_overrides['overrides'] or {}).items():
+            for model_path, overrides in models.items():
+                plan = self._merge_plans.setdefault((service, model_path), MergePlan())
+                plan.global_overrides = overrides
 
-                # if site specifc override provided, add them to self.microsites
-                if val.get('overrides'):
-                    self.microsites[key]['overrides'] = deep_merge(
-                        self.microsites[key]['overrides'],
-                        val['overrides']
-                    )
+        if self.site_for_each_organization:
+            # each microsite only shows the courses of its organization
+            plan = self._merge_plans.setdefault(('lms', LMS_SITE_CONFIGURATION), MergePlan())
+            plan.template = OverrideTemplate(('site_values', 'course_org_filter'))
 
-                # if site specifc context override provided, add them to self.microsites
-                if val.get('context_overrides'):
-                    self.microsites[key]['context_overrides'] = deep_merge(
-                        self.microsites[key]['context_overrides'],
-                        val['context_overrides']
-                    )
+        for code in self.microsites:
+            self._add_site_merge_plans(code)
+
+    def _add_site_merge_plans(self, code):
+        """
+        Add site specific overrides of a microsite to the merge plans.
+        """
+        for service, models in (self.microsites[code].overrides or {}).items():
+            for model_path, overrides in models.items():
+                plan = self._merge_plans.setdefault((service, model_path), MergePlan())
+                plan.site_overrides[code] = overrides
 
     def _extract_microsites(self, config):
         """
         A helper method to prepare self.microsites from given config.
         """
+        microsites = config['microsites'] or {}
+
         # if there will be a site for each organization
-        if config.get('site_for_each_organization', False):
-            for key, val in config['organizations'].items():
-                self.microsites[key] = {
-                    'name': val['name'],
-                    'overrides': {
-                        'lms': {
-                            'openedx.core.djangoapps.site_configuration.models.SiteConfiguration': {
-                                'site_values': {
-                                    'course_org_filter': key
-                                }
-                            }
-                        }
-                    },
-                    'context_overrides': {},
-                }
+        if self.site_for_each_organization:
+            for code, name in self.organizations.items():
+                self.microsites[code] = Microsite.from_config(name, microsites.get(code))
         else:
             # otherwise microsites can be given seperately from organizations
-            for key, val in config['microsites'].items():
+            for key, val in microsites.items():
                 # $ is a special key and used for global overrides
                 if key == '$':
                     continue
 
-                self.microsites[key] = {
-                    'name': val['name'],
-                    'overrides': {},
-                    'context_overrides': {},
-                }
+                self.microsites[intern(key)] = Microsite.from_config(val['name'], val)
+
+    def _get_microsite(self, code):
+        """
+        Returns the Microsite record of a code.
+        """
+        return self.microsites[code]
+
+    def select(self, selector):
+        """
+        Restrict organization and microsite codes to the ones matching a CodeSelector.
+        """
+        self.selector = selector or None
+
+    def _select_codes(self, index):
+        if self.selector is None:
+            return index
+        return self.selector.select(index)
 
     def get_microsite_codes(self):
         """
         Get list of microsite codes
         """
-        return self.microsites.keys()
+        return self._select_codes(self.microsites.keys())
 
     def get_organization_codes(self):
         """
         Get list of organization codes
         """
-        return self.organizations.keys()
+        return self._select_codes(self.organizations.keys())
 
     def get_organization_name(self, code):
         """
         Given an organization code, returns its name
         """
-        return self.organizations[code]['name']
+        return self.organizations[code]
 
     def get_context(self, code):
         """
-        Prepares and returns a dictionary with usefull values for generating
+        Returns a read-only mapping with usefull values for generating
         microsite configurations.
         """
-        microsite = self.microsites[code]
+        context = self._contexts.get(code)
+        if context is None:
+            context = self._resolve_context(code)
+            if self._keep_contexts:
+                self._contexts[code] = context
+        return context
+
+    def _resolve_context(self, code):
+        """
+        Prepares the context of a microsite, with global and site specific
+        context overrides applied.
+        """
+        microsite = self._get_microsite(code)
         lms_domain = '{}.{}'.format(code.lower(), self.main_domain)
         discovery_domain = 'discovery.{}'.format(lms_domain)
         ecommerce_domain = 'ecommerce.{}'.format(lms_domain)
         studio_domain = 'studio.{}'.format(lms_domain)
 
         context = {
-            'name': microsite['name'],
+            'name': microsite.name,
             'code': code,
             'main_domain': self.main_domain,
             'lms_domain': lms_domain,
@@ -189,62 +947,256 @@ class Config:
         context.update(self.global_overrides['context_overrides'])
 
         # apply site specific context overrides
-        context.update(microsite['context_overrides'])
+        if microsite.context_overrides:
+            context.update(microsite.context_overrides)
 
-        return context
+        keys = tuple(context)
+        index = self._context_indexes.get(keys)
+        if index is None:
+            index = self._context_indexes[keys] = {key: position for position, key in enumerate(keys)}
+        return Context(index, tuple(context.values()))
 
     def apply_overrides(self, code, service, model_class, data):
         """
-        Overrides existing value with global or site-specific value.
+        Returns a copy of data with global and site-specific values applied.
+        Values in data take precedence over the overrides.
 
         Args:
             code (str): microsite code
             service (str): service key
-            model_class (Model): django model
+            model_class (Model|str): django model, or its dotted path
             data (dict): data dictionary that will be used to update the model
         """
-        microsite = self.microsites[code]
-        global_overrides = self.global_overrides['overrides']
-        site_overrides = microsite['overrides']
+        plan = self._merge_plans.get((service, get_model_path(model_class)))
+        if plan is None:
+            return data
+        return plan.apply(code, data)
+
+
+class FragmentConfig(Config):
+    """
+    Configuration split in a directory of YAML fragments::
+
+        $.yaml                      main_domain, oauth, site_for_each_organization,
+                                    and the global `overrides` and `context_overrides`
+        organizations/<code>.yaml   organization `name`
+        microsites/<code>.yaml      microsite `name`, `overrides` and `context_overrides`
+
+    Only the globals file is parsed while loading. Codes are indexed from the
+    fragment file names, and a fragment is parsed the first time its organization
+    or microsite is used. With `site_for_each_organization`, microsite fragments are
+    optional and only hold overrides.
+    """
+
+    # A mapping of fragment path and its version and parsed content, shared between
+    # loads when set, so that only changed fragments are parsed again
+    parsed_fragments = None
+
+    def __init__(self, directory, resolve_contexts='lazy'):
+        """
+        Args:
+            directory (str): configuration directory
+            resolve_contexts (str): `transient` doesn't keep resolved contexts, otherwise
+                each one is resolved on first use
+        """
+        config = self._read_fragment(os.path.join(directory, GLOBALS_FRAGMENT))
+        self._keep_contexts = resolve_contexts != 'transient'
+
+        self.microsites = {}
+        self.global_overrides = {
+            'overrides': config.get('overrides') or {},
+            'context_overrides': config.get('context_overrides') or {},
+        }
+        self.organizations = {}
+        self.main_domain = config['main_domain']
+        self.oauth = config.get('oauth', dict(DEFAULT_OAUTH))
+        self.site_for_each_organization = config.get('site_for_each_organization', False)
+
+        # A mapping of code and fragment file path
+        self._organization_files = _index_fragments(os.path.join(directory, 'organizations'))
+        self._microsite_files = _index_fragments(os.path.join(directory, 'microsites'))
+
+        self._compile_merge_plans()
+        self._contexts = {}
+        self._context_indexes = {}
+
+    def _get_microsite(self, code):
+        """
+        Parse the fragments of a microsite, and add its overrides to the merge plans.
+        """
+        microsite = self.microsites.get(code)
+        if microsite is not None:
+            return microsite
+
+        fragment = self._read_fragment(self._microsite_files[code]) if code in self._microsite_files else {}
+        if self.site_for_each_organization:
+            name = self.get_organization_name(code)
+        else:
+            name = fragment['name']
+
+        microsite = self.microsites[intern(code)] = Microsite.from_config(name, fragment)
+        self._add_site_merge_plans(code)
+        return microsite
+
+    def get_microsite_codes(self):
+        """
+        Get list of microsite codes
+        """
+        if self.site_for_each_organization:
+            return self._select_codes(self._organization_files.keys())
+        return self._select_codes(self._microsite_files.keys())
 
-        model_path = '{}.{}'.format(model_class.__module__, model_class.__name__)
+    def get_organization_codes(self):
+        """
+        Get list of organization codes
+        """
+        return self._select_codes(self._organization_files.keys())
+
+    def get_organization_name(self, code):
+        """
+        Given an organization code, returns its name
+        """
+        name = self.organizations.get(code)
+        if name is None:
+            organization = self._read_fragment(self._organization_files[code])
+            name = self.organizations[intern(code)] = intern(organization['name'])
+        return name
+
+    def apply_overrides(self, code, service, model_class, data):
+        self._get_microsite(code)
+        return super().apply_overrides(code, service, model_class, data)
 
-        # if global override exists, apply them
-        if service in global_overrides and model_path in global_overrides[service]:
-            data = deep_merge(data, global_overrides[service][model_path])
+    def _read_fragment(self, file_path):
+        """
+        Parse a fragment, or reuse its parsed content if it did not change since the last load.
+        """
+        if self.parsed_fragments is None:
+            return _read_yaml(file_path)
 
-        # if site specific override exists, apply them
-        if service in site_overrides and model_path in site_overrides[service]:
-            data = deep_merge(data, site_overrides[service][model_path])
+        stat = os.stat(file_path)
+        version = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        parsed = self.parsed_fragments.get(file_path)
+        if parsed is None or parsed[0] != version:
+            parsed = self.parsed_fragments[file_path] = (version, _read_yaml(file_path))
+        return parsed[1]
 
-        return data
 
+def _read_yaml(file_path):
+    with open(file_path, 'rb') as file:
+        return yaml.load(file, Loader=YamlLoader) or {}
 
-def load_config(file_path) -> Config:
+
+def _index_fragments(directory):
     """
-    Helper function to load configuration yaml file
+    Returns a mapping of code and path of the YAML fragments in a directory.
     """
-    with open(file_path) as file:
-        config = yaml.load(file)
-    return Config(config)
+    if not os.path.isdir(directory):
+        return {}
 
+    index = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            code, extension = os.path.splitext(entry.name)
+            if extension in ('.yaml', '.yml') and entry.is_file():
+                index[code] = entry.path
+    return dict(sorted(index.items()))
 
-def write_generated_values(data = {}):
+
+def read_config(file_path):
     """
-    Write new config value to the generated config file.
+    Parse a configuration file, or every fragment of a configuration directory
+    into the equivalent configuration.
+
+    Args:
+        file_path (str): configuration file or directory
+    Returns:
+        config (dict): parsed configuration
     """
-    values = load_generated_values()
-    values.update(data)
-    with open(GENERATED_SHARED_CONFIG_FILE, 'w') as file:
-        yaml.dump(values, file)
+    if not os.path.isdir(file_path):
+        return _read_yaml(file_path)
+
+    config = _read_yaml(os.path.join(file_path, GLOBALS_FRAGMENT))
+    microsites = {
+        '$': {
+            'overrides': config.pop('overrides', None) or {},
+            'context_overrides': config.pop('context_overrides', None) or {},
+        }
+    }
+    for code, fragment_path in _index_fragments(os.path.join(file_path, 'microsites')).items():
+        microsites[code] = _read_yaml(fragment_path)
+    config['microsites'] = microsites
+    config['organizations'] = {
+        code: _read_yaml(fragment_path)
+        for code, fragment_path in _index_fragments(os.path.join(file_path, 'organizations')).items()
+    }
+    return config
+
+
+def load_config(file_path, resolve_contexts='eager', cache=True) -> Config:
+    """
+    Helper function to load configuration yaml file
+
+    The parsed Config is pickled in CONFIG_CACHE_DIR, keyed by the file content,
+    so that later runs and the other services skip parsing an unchanged file.
+
+    A directory of fragments is loaded as a FragmentConfig instead, which parses
+    each fragment on first use and is never cached.
+
+    Configuration files are validated before anything is built, see validation.py.
+    Fragments are only parsed on first use, so directories are not: check them
+    with `python scripts/validation.py <directory>`.
+
+    Args:
+        file_path (str): configuration file or directory
+        resolve_contexts (str): `eager` or `lazy` context resolution, see Config
+        cache (bool): whether the parsed config cache is used
+    Raises:
+        ConfigError: listing every error of an invalid configuration file
+    """
+    if os.path.isdir(file_path):
+        return FragmentConfig(file_path, resolve_contexts)
+
+    with open(file_path, 'rb') as file:
+        content = file.read()
+
+    if not cache:
+        return _build_config(content, file_path, resolve_contexts)
+
+    key = hashlib.sha256(content).hexdigest()
+    cache_path = os.path.join(
+        CONFIG_CACHE_DIR,
+        '{}.pickle'.format(hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest())
+    )
+
+    try:
+        with open(cache_path, 'rb') as file:
+            cached = pickle.load(file)
+        if cached['version'] == CONFIG_CACHE_VERSION and cached['key'] == (key, resolve_contexts):
+            return cached['config']
+    except Exception:
+        # missing, stale or unreadable (e.g. written by another python version) cache
+        pass
+
+    config = _build_config(content, file_path, resolve_contexts)
+
+    try:
+        os.makedirs(CONFIG_CACHE_DIR, exist_ok=True)
+        with atomic_write(cache_path, 'wb') as file:
+            pickle.dump(
+                {'version': CONFIG_CACHE_VERSION, 'key': (key, resolve_contexts), 'config': config},
+                file,
+                protocol=pickle.HIGHEST_PROTOCOL
+            )
+    except OSError:
+        logger.warning('Could not write config cache {}'.format(cache_path))
+
+    return config
 
 
-def load_generated_values():
+def _build_config(content, file_path, resolve_contexts):
     """
-    Read config value from the generated config file.
+    Parse and validate the content of a configuration file, then build its Config.
     """
-    values = {}
-    if os.path.exists(GENERATED_SHARED_CONFIG_FILE):
-        with open(GENERATED_SHARED_CONFIG_FILE) as file:
-            values = yaml.load(file)
-    return values
+    data = yaml.load(content, Loader=YamlLoader)
+    check_config(data, file_path)
+    return Config(data, resolve_contexts=resolve_contexts)
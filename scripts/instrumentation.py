@@ -0,0 +1,194 @@
+import json
+import sys
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager, nullcontext
+from files import write_atomically
+
+
+# prefix of the prometheus metric names
+METRIC_PREFIX = 'microsite_generator'
+
+
+class StageStats:
+    """
+    Measurements of a generator stage, accumulated over every time it runs.
+    """
+
+    __slots__ = ('name', 'wall_time', 'queries', 'query_time', 'created', 'updated', 'unchanged')
+
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def add(self, data):
+        for name in self.__slots__[1:]:
+            setattr(self, name, getattr(self, name) + data[name])
+
+    def count_queries(self, execute, sql, params, many, context):
+        """
+        Django database execute wrapper counting queries and their time.
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - start
+
+
+class Instrumentation:
+    """
+    Records wall time, database queries and rows created, updated or unchanged
+    for each stage of a generator run, and which rows each microsite got.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Forget every measurement.
+        """
+        self.stages = {}
+        # A mapping of microsite code and row outcome by stage
+        self.microsites = defaultdict(dict)
+        self._current = []
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager measuring a stage. Database queries are only counted once
+        django is set up.
+        """
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats(name)
+
+        self._current.append(stats)
+        start = time.perf_counter()
+        try:
+            with self._query_counter(stats):
+                yield stats
+        finally:
+            stats.wall_time += time.perf_counter() - start
+            self._current.pop()
+
+    def _query_counter(self, stats):
+        """
+        Returns a context manager counting queries of every database alias, e.g. the
+        read alias of --read-db too.
+        """
+        apps = sys.modules.get('django.apps')
+        if apps is None or not apps.apps.ready:
+            return nullcontext()
+
+        from django.db import connections
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats.count_queries))
+        return stack
+
+    def record_rows(self, created=(), updated=(), unchanged=()):
+        """
+        Record row outcomes of microsite codes in the current stage.
+
+        Args:
+            created (iterable): codes whose row was created
+            updated (iterable): codes whose row was updated
+            unchanged (iterable): codes whose row was already up to date
+        """
+        if not self._current:
+            return
+        stats = self._current[-1]
+        for outcome, codes in (('created', created), ('updated', updated), ('unchanged', unchanged)):
+            for code in codes:
+                self.microsites[code][stats.name] = outcome
+                setattr(stats, outcome, getattr(stats, outcome) + 1)
+
+    def get_changed_codes(self, stages, codes=None):
+        """
+        Returns codes whose rows were created or updated in any of the given stages.
+
+        Args:
+            stages (iterable): stage names
+            codes (iterable): only look at these codes, every recorded code by default
+        """
+        if codes is None:
+            codes = self.microsites
+        return [
+            code for code in codes
+            if any(self.microsites.get(code, {}).get(stage) in ('created', 'updated') for stage in stages)
+        ]
+
+    def export(self):
+        """
+        Returns recorded measurements as plain data.
+        """
+        return {
+            'stages': [stats.as_dict() for stats in self.stages.values()],
+            'microsites': dict(self.microsites),
+        }
+
+    def merge(self, data):
+        """
+        Add measurements exported by another process, e.g. a worker.
+        """
+        for stage in data['stages']:
+            stats = self.stages.get(stage['name'])
+            if stats is None:
+                stats = self.stages[stage['name']] = StageStats(stage['name'])
+            stats.add(stage)
+        for code, outcomes in data['microsites'].items():
+            self.microsites[code].update(outcomes)
+
+    def write_json(self, file_path, service):
+        """
+        Write a JSON report of the run.
+        """
+        report = dict(self.export(), service=service, finished_at=time.time())
+        write_atomically(file_path, json.dumps(report, indent=1, sort_keys=True))
+
+    def write_prometheus(self, file_path, service):
+        """
+        Write stage measurements in the prometheus text format, e.g. for the
+        node exporter textfile collector.
+        """
+        metrics = (
+            ('stage_duration_seconds', 'Wall time of a generator stage.', 'wall_time'),
+            ('stage_queries', 'Database queries made by a generator stage.', 'queries'),
+            ('stage_query_duration_seconds', 'Time spent in database queries by a generator stage.', 'query_time'),
+        )
+        lines = []
+        for metric, description, attribute in metrics:
+            lines.append('# HELP {}_{} {}'.format(METRIC_PREFIX, metric, description))
+            lines.append('# TYPE {}_{} gauge'.format(METRIC_PREFIX, metric))
+            for stats in self.stages.values():
+                lines.append('{}_{}{{service="{}",stage="{}"}} {}'.format(
+                    METRIC_PREFIX, metric, service, stats.name, getattr(stats, attribute)
+                ))
+
+        lines.append('# HELP {}_stage_rows Rows by outcome of a generator stage.'.format(METRIC_PREFIX))
+        lines.append('# TYPE {}_stage_rows gauge'.format(METRIC_PREFIX))
+        for stats in self.stages.values():
+            for outcome in ('created', 'updated', 'unchanged'):
+                lines.append('{}_stage_rows{{service="{}",stage="{}",outcome="{}"}} {}'.format(
+                    METRIC_PREFIX, service, stats.name, outcome, getattr(stats, outcome)
+                ))
+
+        lines.append('# HELP {}_last_run_timestamp_seconds End of the last generator run.'.format(METRIC_PREFIX))
+        lines.append('# TYPE {}_last_run_timestamp_seconds gauge'.format(METRIC_PREFIX))
+        lines.append('{}_last_run_timestamp_seconds{{service="{}"}} {}'.format(METRIC_PREFIX, service, time.time()))
+        write_atomically(file_path, '\n'.join(lines) + '\n')
+
+
+# instrumentation of the current process, shared by every module through generator_utils
+instrumentation = Instrumentation()
@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+from collections import defaultdict
+from collections.abc import Mapping
+from const import JOURNAL_FILE
+from files import write_atomically
+
+
+logger = logging.getLogger(__name__)
+
+# code of stages which are not split by microsite, e.g. the eCommerce redirect URIs
+WHOLE_STAGE = '$'
+
+
+class Journal:
+    """
+    Append-only record of the (stage, code) pairs written by a run, so that an
+    interrupted run can be resumed where it stopped.
+
+    A batch is recorded once its transaction is committed. The first line holds
+    the digest of the plan the journal was written for, a journal written for
+    another plan is never resumed.
+    """
+
+    def __init__(self, service, digest, resume=False, path=None):
+        """
+        Args:
+            service (str): service key
+            digest (str): fingerprint of the plan of this run
+            resume (bool): skip the work recorded by the previous run, otherwise start over
+            path (str): journal file path
+        """
+        self.path = path or JOURNAL_FILE.format(service)
+        self.digest = digest
+        # A mapping of stage and completed codes
+        self.completed = defaultdict(set)
+
+        if not (resume and self._load()):
+            self._start()
+
+    def _load(self):
+        """
+        Read the completed pairs of the previous run. Returns whether it can be resumed.
+        """
+        if not os.path.exists(self.path):
+            logger.info('No journal in {}, starting from the beginning'.format(self.path))
+            return False
+
+        with open(self.path) as file:
+            lines = file.read().splitlines()
+
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            header = {}
+        if header.get('digest') != self.digest:
+            logger.warning('The plan changed since {} was written, starting from the beginning'.format(self.path))
+            return False
+
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line may have been cut by the interruption
+                continue
+            self.completed[entry['stage']].update(entry['codes'])
+
+        logger.info('Resuming from {}: {}'.format(self.path, ', '.join(
+            '{} {} done'.format(stage, len(codes)) for stage, codes in self.completed.items()
+        ) or 'nothing done'))
+        return True
+
+    def _start(self):
+        write_atomically(self.path, json.dumps({'digest': self.digest}) + '\n')
+
+    def pending(self, stage, items):
+        """
+        Returns the items whose code has not been completed in a stage.
+
+        Args:
+            stage (str)
+            items (iterable|dict): codes, or a mapping of code and planned values
+        """
+        completed = self.completed.get(stage)
+        if not completed:
+            return items
+        if isinstance(items, Mapping):
+            return {code: values for code, values in items.items() if code not in completed}
+        return [code for code in items if code not in completed]
+
+    def is_completed(self, stage, code=WHOLE_STAGE):
+        return code in self.completed.get(stage, ())
+
+    def record(self, stage, codes=(WHOLE_STAGE,)):
+        """
+        Record codes whose stage has been committed. Each record is a single
+        write of one line, so worker processes can share the journal.
+        """
+        codes = list(codes)
+        with open(self.path, 'a') as file:
+            file.write(json.dumps({'stage': stage, 'codes': codes}) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self.completed[stage].update(codes)
+
+    def clear(self):
+        """
+        Remove the journal, once the run finished successfully.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,120 @@
+import logging
+import os
+import subprocess
+import sys
+import time
+import uuid
+from argparse import ArgumentParser
+from generated_values import RUN_ID_VARIABLE, SSO_KEYS, SSO_RUN_KEY, generated_store
+
+
+logger = logging.getLogger(__name__)
+
+# seconds between two checks of the running generators
+POLL_INTERVAL = 0.5
+
+
+class Job:
+    """
+    A service generator running in a subprocess.
+    """
+
+    def __init__(self, name, command, env=None):
+        self.name = name
+        self.command = command
+        self.env = env
+        self.process = None
+        self.started = None
+        self.duration = None
+        self.returncode = None
+
+    def start(self):
+        logger.info('Starting {}: {}'.format(self.name, ' '.join(self.command)))
+        self.started = time.monotonic()
+        self.process = subprocess.Popen(self.command, env=self.env)
+
+    @property
+    def running(self):
+        return self.process is not None and self.returncode is None
+
+    def poll(self):
+        """
+        Returns the exit code of the generator, or None if it's still running.
+        """
+        if self.running:
+            self.returncode = self.process.poll()
+            if self.returncode is not None:
+                self.duration = time.monotonic() - self.started
+                logger.info('{} finished with status {} in {:.1f}s'.format(self.name, self.returncode, self.duration))
+        return self.returncode
+
+
+def sso_credentials_ready(run_id):
+    """
+    Whether the LMS generator of the run identified by `run_id` has shared the eCommerce SSO credentials.
+    """
+    values = generated_store.read()
+    return values.get(SSO_RUN_KEY) == run_id and all(values.get(key) for key in SSO_KEYS)
+
+
+def orchestrate(target_prefix=''):
+    """
+    Run the LMS and discovery generators in parallel, and start the eCommerce
+    generator as soon as the LMS generator has shared the SSO credentials.
+
+    Args:
+        target_prefix (str): Makefile target prefix, e.g. `dev.`
+    Returns:
+        status (int): 0 if every generator succeeded, 1 otherwise
+    """
+    run_id = uuid.uuid4().hex
+    env = dict(os.environ, **{RUN_ID_VARIABLE: run_id})
+    jobs = {
+        name: Job(name, ['make', '{}run-{}'.format(target_prefix, name)], env)
+        for name in ('lms', 'discovery', 'ecommerce')
+    }
+    lms, ecommerce = jobs['lms'], jobs['ecommerce']
+
+    start = time.monotonic()
+    jobs['lms'].start()
+    jobs['discovery'].start()
+
+    while any(job.running for job in jobs.values()) or ecommerce.process is None:
+        for job in jobs.values():
+            job.poll()
+
+        if ecommerce.process is None:
+            if lms.returncode not in (None, 0):
+                logger.error('lms failed before sharing SSO credentials, not starting ecommerce')
+                ecommerce.returncode = lms.returncode
+                break
+            if lms.returncode == 0 or sso_credentials_ready(run_id):
+                ecommerce.start()
+
+        time.sleep(POLL_INTERVAL)
+
+    # wait for the remaining generators, if eCommerce could not be started
+    for job in jobs.values():
+        if job.running:
+            job.process.wait()
+            job.poll()
+
+    wall_time = time.monotonic() - start
+    sequential_time = sum(job.duration or 0 for job in jobs.values())
+    logger.info('Finished in {:.1f}s, {:.1f}s saved compared to running generators one after another'.format(
+        wall_time, sequential_time - wall_time
+    ))
+
+    failed = [job.name for job in jobs.values() if job.returncode != 0]
+    if failed:
+        logger.error('Failed generators: {}'.format(', '.join(failed)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    parser = ArgumentParser(description="Run the generators of every service concurrently.")
+    parser.add_argument("--target-prefix", type=str, default='', help="Makefile target prefix, e.g. `dev.`")
+    cli_args = parser.parse_args()
+    sys.exit(orchestrate(cli_args.target_prefix))
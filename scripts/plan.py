@@ -0,0 +1,100 @@
+import json
+import logging
+from argparse import ArgumentParser
+from const import PLAN_FILE
+from files import atomic_write
+from generator_utils import load_config
+
+
+logger = logging.getLogger(__name__)
+
+# bump this whenever the structure of a service plan, or the values planned for a configuration, change
+PLAN_VERSION = 3
+
+SERVICES = ('lms', 'discovery', 'ecommerce')
+
+
+def compile_plan(config):
+    """
+    Compile the desired state of every service from the configuration, without django.
+
+    Args:
+        config (Config)
+    Returns:
+        plan (dict)
+    """
+    # service generators are imported here, as they import this module to load plans
+    import generate_discovery
+    import generate_ecommerce
+    import generate_lms
+
+    return {
+        'version': PLAN_VERSION,
+        'services': {
+            'lms': generate_lms.build_plan(config),
+            'discovery': generate_discovery.build_plan(config),
+            'ecommerce': generate_ecommerce.build_plan(config),
+        }
+    }
+
+
+def write_plan(plan, file_path=PLAN_FILE):
+    """
+    Write a compiled plan as JSON.
+    """
+    with atomic_write(file_path) as file:
+        json.dump(plan, file, indent=1, sort_keys=True, default=str)
+
+
+def load_plan(file_path, service, selector=None):
+    """
+    Read the plan of a service from a compiled plan file.
+
+    Args:
+        file_path (str)
+        service (str): service key
+        selector (CodeSelector): only keep the organizations and microsites it selects
+    Returns:
+        plan (dict): the service plan
+    """
+    with open(file_path) as file:
+        plan = json.load(file)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError('{} was compiled with another plan version, compile it again'.format(file_path))
+
+    plan = plan['services'][service]
+    if selector:
+        for group in ('organizations', 'microsites'):
+            if group in plan:
+                plan[group] = selector.filter(plan[group])
+    return plan
+
+
+def iter_microsites(plan, codes=None):
+    """
+    Yields the code and planned values of microsites of a service plan.
+
+    Args:
+        plan (dict): service plan
+        codes (iterable): microsite codes, every planned microsite by default
+    """
+    microsites = plan['microsites']
+    for code in microsites if codes is None else codes:
+        yield code, microsites[code]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = ArgumentParser(description="Compile the desired state of every service, without django.")
+    parser.add_argument("ConfigFilePath", metavar='config_file_path', type=str, help="Configuration data file path.")
+    parser.add_argument("--output", type=str, default=PLAN_FILE, help="Plan file path.")
+    parser.add_argument(
+        "--no-config-cache", dest="config_cache", action="store_false", help="Always parse the configuration file."
+    )
+    cli_args = parser.parse_args()
+
+    compiled = compile_plan(load_config(cli_args.ConfigFilePath, cache=cli_args.config_cache))
+    write_plan(compiled, cli_args.output)
+    logger.info('Plan of {} microsites written to {}'.format(
+        len(compiled['services']['lms']['microsites']), cli_args.output
+    ))
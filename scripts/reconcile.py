@@ -0,0 +1,346 @@
+import logging
+from collections import defaultdict
+from itertools import chain, islice
+from instrumentation import instrumentation
+
+
+logger = logging.getLogger(__name__)
+
+# maximum number of values sent to the database in a single `__in` lookup
+QUERY_CHUNK_SIZE = 500
+
+# maximum number of rows written by a single bulk_create / bulk_update query
+WRITE_CHUNK_SIZE = 200
+
+
+def chunked(items, size):
+    """
+    Split given items into lists of at most `size` elements.
+    Items are consumed lazily, so iterators are never loaded at once.
+
+    Args:
+        items (iterable)
+        size (int)
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_field(model_class, field_name):
+    """
+    Returns the django field of a model, or None if `field_name` is not a field.
+    """
+    from django.core.exceptions import FieldDoesNotExist
+
+    try:
+        return model_class._meta.get_field(field_name)
+    except FieldDoesNotExist:
+        return None
+
+
+def get_lookup_value(model_class, field_name, value):
+    """
+    Returns the value used to index rows of `model_class` by `field_name`.
+    Related objects are indexed by their primary key.
+    """
+    field = get_field(model_class, field_name)
+    if field is not None and field.is_relation:
+        return getattr(value, 'pk', value)
+    return value
+
+
+def prefetch(model_class, field_name, values, chunk_size=QUERY_CHUNK_SIZE, using=None):
+    """
+    Load existing rows of a model in chunked `__in` queries.
+
+    Args:
+        model_class (Model): django model
+        field_name (str): field used to look the rows up, e.g. `domain` or `site`
+        values (iterable): field values (or related instances) to look for
+        chunk_size (int): maximum number of values per query
+        using (str): database alias, the one django routes reads to by default
+    Returns:
+        index (dict): A mapping of lookup value and model instance
+    """
+    field = model_class._meta.get_field(field_name)
+    keys = {get_lookup_value(model_class, field_name, value) for value in values}
+    keys.discard(None)
+
+    manager = model_class.objects if using is None else model_class.objects.using(using)
+    index = {}
+    for chunk in chunked(sorted(keys), chunk_size):
+        queryset = manager.filter(**{'{}__in'.format(field.attname): chunk})
+        for instance in queryset:
+            index[getattr(instance, field.attname)] = instance
+    return index
+
+
+class ReadRouting:
+    """
+    Sends the bulk existence checks and state comparisons of the generators to a
+    read database alias, e.g. a replica, so that the default database only gets
+    the writes.
+
+    Lookup values of rows written by this process are recorded, and these rows
+    are always read back from the default database, as the replica may not have
+    them yet. Rows the replica does not have are looked up again in the default
+    database, so that rows written by other processes are not created twice.
+    """
+
+    def __init__(self):
+        # database alias of reads, None to let django route them
+        self.alias = None
+        # lookup values of written rows, by (model, lookup field)
+        self.written = defaultdict(set)
+
+    def record(self, model_class, field_name, values):
+        """
+        Record rows written to the default database, by lookup field values.
+        """
+        if self.alias is not None:
+            self.written[model_class, field_name].update(
+                get_lookup_value(model_class, field_name, value) for value in values
+            )
+
+    def prefetch(self, model_class, field_name, values, chunk_size=QUERY_CHUNK_SIZE, primary=False):
+        """
+        Like prefetch, reading from the read alias, except rows written by this process.
+
+        Args:
+            primary (bool): read every row from the default database, e.g. rows whose
+                current values are merged with desired values and written back
+        """
+        if self.alias is None:
+            return prefetch(model_class, field_name, values, chunk_size)
+
+        from django.db import DEFAULT_DB_ALIAS
+
+        keys = {get_lookup_value(model_class, field_name, value) for value in values}
+        if primary:
+            return prefetch(model_class, field_name, keys, chunk_size, using=DEFAULT_DB_ALIAS)
+        fresh = keys & self.written.get((model_class, field_name), set())
+
+        index = prefetch(model_class, field_name, keys - fresh, chunk_size, using=self.alias)
+        for instance in index.values():
+            # the rows are updated, and related to new rows, in the default database
+            instance._state.db = DEFAULT_DB_ALIAS
+        # rows missing from the replica may have been written by another process since,
+        # check them against the default database before they are created
+        missing = keys - set(index)
+        if missing:
+            index.update(prefetch(model_class, field_name, missing, chunk_size, using=DEFAULT_DB_ALIAS))
+        return index
+
+    def get(self, model_class, field_name, value):
+        """
+        Returns the row whose lookup field has a value, None if there is none.
+        """
+        key = get_lookup_value(model_class, field_name, value)
+        return self.prefetch(model_class, field_name, [key]).get(key)
+
+
+# reads of the current process, configured with --read-db
+read_routing = ReadRouting()
+
+
+def get_changed_fields(instance, values):
+    """
+    Compare a model instance with the desired field values.
+    Values which are not concrete model fields are ignored.
+
+    Args:
+        instance (Model): django model instance
+        values (dict): desired field values
+    Returns:
+        changed (list): names of the fields whose value differs
+    """
+    changed = []
+    for name, value in values.items():
+        field = get_field(type(instance), name)
+        if field is None or not field.concrete:
+            logger.debug('Ignoring {} - not a field of {}'.format(name, type(instance).__name__))
+            continue
+        if field.is_relation:
+            # compare primary keys, so that related objects are not fetched
+            current = getattr(instance, field.attname)
+            value = getattr(value, 'pk', value)
+        else:
+            current = getattr(instance, name)
+        if current != value:
+            changed.append(name)
+    return changed
+
+
+class Reconciliation:
+    """
+    Sorts the desired rows of a model into rows to create, to update and
+    rows that are already up to date, using a single prefetch of existing rows.
+    """
+
+    def __init__(self, model_class, lookup_field, update=True, merge=None, bulk=True):
+        """
+        Args:
+            model_class (Model): django model
+            lookup_field (str): field that identifies a row, e.g. `domain`
+            update (bool): whether existing rows should be updated, otherwise
+                they are only created when missing
+            merge (callable): optional `merge(instance, values) -> values` hook to
+                combine existing row values with desired values before comparing.
+                Existing rows are then read from the default database, as merging
+                onto a stale copy would revert the latest edits.
+            bulk (bool): write with bulk_create / bulk_update. Disable it for models
+                relying on save() or post_save signals.
+        """
+        self.model_class = model_class
+        self.lookup_field = lookup_field
+        self.update = update
+        self.merge = merge
+        self.bulk = bulk
+
+        self.desired = {}
+        self.to_create = {}
+        self.to_update = {}
+        self.unchanged = {}
+
+        # number of rows written by save()
+        self.created = 0
+        self.updated = 0
+
+    def add(self, code, values):
+        """
+        Register desired field values of a microsite.
+        """
+        self.desired[code] = values
+
+    def classify(self):
+        """
+        Fetch existing rows and sort each registered microsite into create,
+        update or no-op. No further reads are made after this call.
+        """
+        existing = read_routing.prefetch(
+            self.model_class,
+            self.lookup_field,
+            [values[self.lookup_field] for values in self.desired.values()],
+            primary=self.merge is not None
+        )
+
+        for code, values in self.desired.items():
+            key = get_lookup_value(self.model_class, self.lookup_field, values[self.lookup_field])
+            instance = existing.get(key)
+
+            if instance is None:
+                self.to_create[code] = values
+                continue
+
+            if self.update:
+                if self.merge:
+                    values = self.merge(instance, values)
+                    self.desired[code] = values
+                changed = get_changed_fields(instance, values)
+                if changed:
+                    for name in changed:
+                        setattr(instance, name, values[name])
+                    self.to_update[code] = (instance, changed)
+                    continue
+            self.unchanged[code] = instance
+
+        logger.info('{}: {} to create, {} to update, {} unchanged'.format(
+            self.model_class.__name__, len(self.to_create), len(self.to_update), len(self.unchanged)
+        ))
+
+    def save(self):
+        """
+        Write pending changes to the database. Rows are created and updated in
+        chunked bulk queries, and only changed fields are written.
+
+        Returns:
+            instances (dict): A mapping of microsite code and model instance
+        """
+        instances = dict(self.unchanged)
+        instances.update(self._create())
+        instances.update(self._update())
+        instrumentation.record_rows(self.to_create, self.to_update, self.unchanged)
+        read_routing.record(
+            self.model_class,
+            self.lookup_field,
+            [self.desired[code][self.lookup_field] for code in chain(self.to_create, self.to_update)]
+        )
+        return instances
+
+    def _create(self):
+        """
+        Create missing rows. Returns a mapping of microsite code and created instance.
+        """
+        # two microsites can resolve to the same row, only create it once
+        pending = {}
+        codes = defaultdict(list)
+        for code, values in self.to_create.items():
+            key = get_lookup_value(self.model_class, self.lookup_field, values[self.lookup_field])
+            if key in pending:
+                for name, value in values.items():
+                    setattr(pending[key], name, value)
+            else:
+                pending[key] = self.model_class(**values)
+            codes[key].append(code)
+
+        if not self.bulk:
+            for instance in pending.values():
+                instance.save()
+        else:
+            for chunk in chunked(pending.values(), WRITE_CHUNK_SIZE):
+                self._bulk_create(chunk)
+
+            # some database backends (e.g. MySQL) don't return primary keys from bulk_create
+            missing = [key for key, instance in pending.items() if instance.pk is None]
+            if missing:
+                pending.update(prefetch(
+                    self.model_class,
+                    self.lookup_field,
+                    [getattr(pending[key], self.lookup_field) for key in missing]
+                ))
+
+        self.created += len(pending)
+        return {code: pending[key] for key, key_codes in codes.items() for code in key_codes}
+
+    def _update(self):
+        """
+        Save changed fields of existing rows. Returns a mapping of microsite code and instance.
+        """
+        groups = defaultdict(dict)
+        for code, (instance, changed) in self.to_update.items():
+            groups[tuple(sorted(changed))][instance.pk] = instance
+
+        for fields, instances in groups.items():
+            if self.bulk:
+                for chunk in chunked(instances.values(), WRITE_CHUNK_SIZE):
+                    self._bulk_update(chunk, fields)
+            else:
+                for instance in instances.values():
+                    instance.save(update_fields=fields)
+            self.updated += len(instances)
+
+        return {code: instance for code, (instance, _) in self.to_update.items()}
+
+    def _has_history(self):
+        """
+        Whether the model keeps django-simple-history records, which bulk queries would skip.
+        """
+        return hasattr(self.model_class, 'history')
+
+    def _bulk_create(self, instances):
+        if self._has_history():
+            from simple_history.utils import bulk_create_with_history
+            bulk_create_with_history(instances, self.model_class)
+        else:
+            self.model_class.objects.bulk_create(instances)
+
+    def _bulk_update(self, instances, fields):
+        if self._has_history():
+            from simple_history.utils import bulk_update_with_history
+            bulk_update_with_history(instances, self.model_class, fields)
+        else:
+            self.model_class.objects.bulk_update(instances, fields)
@@ -0,0 +1,87 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from batching import BatchRunner
+from reconcile import read_routing
+from generator_utils import instrumentation, setup_django
+
+
+logger = logging.getLogger(__name__)
+
+
+def init_worker(root_dir, settings_module):
+    """
+    Process pool initializer, each worker sets django up with its own database connections.
+    """
+    setup_django(root_dir, settings_module)
+
+
+def run_shard(process, options, journal, microsites):
+    """
+    Process a shard of microsites in a worker process.
+
+    Args:
+        process (callable): `process(microsites, runner)` function of a service
+        options (Namespace): parsed command line options
+        journal (Journal): journal of the run, shared with the main process
+        microsites (dict): A mapping of microsite code and planned values of this shard
+    Returns:
+        reports (list): BatchReport of every batch written by this worker
+        measurements (dict): instrumentation of this worker since its last shard
+    """
+    read_routing.alias = options.read_db
+    runner = BatchRunner.from_options(options, journal)
+    if runner.max_writes_per_second:
+        # the write rate limit applies to the whole run, share it between workers
+        runner.max_writes_per_second /= options.workers
+    process(microsites, runner)
+
+    measurements = instrumentation.export()
+    instrumentation.reset()
+    return runner.reports, measurements
+
+
+def run_sharded(process, microsites, options, root_dir, settings_module, journal=None):
+    """
+    Split microsites into `options.workers` shards, and process them in a process pool.
+    Planned values are sent to the workers, so they don't need the configuration.
+    Measurements of the workers are merged into the instrumentation of this process,
+    stage wall times add up the time of every worker.
+
+    Args:
+        process (callable): picklable `process(microsites, runner)` function, e.g. a partial
+            of process_microsites with the stages of a service
+        microsites (dict): A mapping of microsite code and planned values
+        options (Namespace): parsed command line options
+        root_dir (str): service root directory
+        settings_module (str): django settings module
+        journal (Journal): journal of the run
+    Returns:
+        reports (list): BatchReport of every batch written by the workers
+    """
+    from django.db import connections
+
+    codes = list(microsites)
+    shards = [
+        {code: microsites[code] for code in codes[index::options.workers]}
+        for index in range(options.workers)
+    ]
+    shards = [shard for shard in shards if shard]
+    logger.info('Processing {} microsites in {} shards'.format(len(codes), len(shards)))
+
+    # workers open their own connections, never share the ones of this process
+    connections.close_all()
+
+    reports = []
+    with ProcessPoolExecutor(
+        max_workers=len(shards) or 1,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,
+        initargs=(root_dir, settings_module),
+    ) as pool:
+        handler = partial(run_shard, process, options, journal)
+        for shard_reports, measurements in pool.map(handler, shards):
+            reports.extend(shard_reports)
+            instrumentation.merge(measurements)
+    return reports
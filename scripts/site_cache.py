@@ -0,0 +1,66 @@
+import logging
+from reconcile import prefetch
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache_keys(template, sites):
+    """
+    Returns a mapping of cache key and site, formatting the template with the
+    `domain` and `site_id` of each site.
+    """
+    return {template.format(domain=site.domain, site_id=site.pk): site for site in sites}
+
+
+def refresh_site_caches(domains, options, site_configuration_model=None):
+    """
+    Invalidate cached sites and site configurations of changed sites only, instead
+    of flushing whole caches, and optionally warm them again.
+
+    Sites are dropped from the django sites cache of this process. Entries of the
+    configured cache backend are found with the `--site-cache-key` and
+    `--site-configuration-cache-key` templates. With `--warm-site-caches`, fresh
+    rows are written in place of the stale entries, so that the first requests to
+    changed sites don't all miss the cache at once.
+
+    Args:
+        domains (list): domains of the changed sites
+        options (Namespace): parsed command line options
+        site_configuration_model (str): dotted path of the service SiteConfiguration
+            model, None if the service has none
+    """
+    from django.contrib.sites.models import SITE_CACHE, Site
+    from django.core.cache import caches
+    from django.utils.module_loading import import_string
+
+    if not domains:
+        return
+
+    # rows have just been written, they are read from the default database
+    sites = prefetch(Site, 'domain', domains)
+    for site in sites.values():
+        SITE_CACHE.pop(site.pk, None)
+        SITE_CACHE.pop(site.domain, None)
+
+    entries = {}
+    if options.site_cache_key:
+        entries.update(get_cache_keys(options.site_cache_key, sites.values()))
+    if options.site_configuration_cache_key and site_configuration_model:
+        site_configurations = prefetch(import_string(site_configuration_model), 'site', sites.values())
+        for key, site in get_cache_keys(options.site_configuration_cache_key, sites.values()).items():
+            entries[key] = site_configurations.get(site.pk)
+
+    cache = caches[options.cache_alias]
+    if options.warm_site_caches:
+        for site in sites.values():
+            SITE_CACHE[site.pk] = site
+            SITE_CACHE[site.domain] = site
+        cache.set_many({key: value for key, value in entries.items() if value is not None})
+        cache.delete_many([key for key, value in entries.items() if value is None])
+    else:
+        cache.delete_many(list(entries))
+
+    logger.info('Site caches: {} sites {}, {} cache entries'.format(
+        len(sites), 'warmed' if options.warm_site_caches else 'invalidated', len(entries)
+    ))
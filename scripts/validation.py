@@ -0,0 +1,167 @@
+import logging
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from collections.abc import Mapping
+
+
+logger = logging.getLogger(__name__)
+
+# context keys of the domains derived from a microsite code
+DOMAIN_KEYS = ('lms_domain', 'discovery_domain', 'ecommerce_domain', 'studio_domain')
+
+
+class ConfigError(ValueError):
+    """
+    Invalid configuration, holding every error found.
+    """
+
+    def __init__(self, errors, source='configuration'):
+        """
+        Args:
+            errors (list): error messages
+            source (str): configuration file or directory
+        """
+        self.errors = errors
+        super().__init__('{} has {} error(s):\n  {}'.format(source, len(errors), '\n  '.join(errors)))
+
+
+def get_domains(code, main_domain, context_overrides):
+    """
+    Returns the domains of a microsite by context key, the way Config resolves its context.
+
+    Args:
+        code (str): microsite code
+        main_domain (str)
+        context_overrides (tuple): global, then site specific context overrides
+    """
+    lms_domain = '{}.{}'.format(code.lower(), main_domain)
+    domains = {
+        'lms_domain': lms_domain,
+        'discovery_domain': 'discovery.{}'.format(lms_domain),
+        'ecommerce_domain': 'ecommerce.{}'.format(lms_domain),
+        'studio_domain': 'studio.{}'.format(lms_domain),
+    }
+    for overrides in context_overrides:
+        for key in DOMAIN_KEYS:
+            if key in overrides:
+                domains[key] = overrides[key]
+    return domains
+
+
+def validate_config(config):
+    """
+    Check a parsed configuration without django, and return every error found.
+
+    Domains of every service are indexed in a single hash table, so collisions
+    between microsites (e.g. codes `A` and `a`) are found in linear time.
+
+    Args:
+        config (dict): parsed configuration file
+    Returns:
+        errors (list): error messages, empty if the configuration is valid
+    """
+    if not isinstance(config, Mapping):
+        return ['the configuration must be a mapping']
+
+    errors = []
+    main_domain = config.get('main_domain')
+    if not main_domain:
+        errors.append('main_domain: missing')
+
+    for group in ('organizations', 'microsites'):
+        # an empty group is valid, but the key is required
+        if group not in config:
+            errors.append('{}: missing'.format(group))
+
+    organizations = config.get('organizations') or {}
+    microsites = config.get('microsites') or {}
+    for group, entries in (('organizations', organizations), ('microsites', microsites)):
+        if not isinstance(entries, Mapping):
+            errors.append('{}: must be a mapping of code and values'.format(group))
+            return errors
+        for code in entries:
+            if not isinstance(code, str):
+                errors.append('{}.{}: codes must be strings, quote it'.format(group, code))
+
+    for code, organization in organizations.items():
+        if not isinstance(organization, Mapping) or not organization.get('name'):
+            errors.append('organizations.{}: missing name'.format(code))
+        elif not isinstance(organization['name'], str):
+            errors.append('organizations.{}: names must be strings, quote it'.format(code))
+
+    global_overrides = microsites.get('$') or {}
+    if not isinstance(global_overrides, Mapping):
+        errors.append('microsites.$: must be a mapping')
+        global_overrides = {}
+    global_context = global_overrides.get('context_overrides') or {}
+    if not isinstance(global_context, Mapping):
+        errors.append('microsites.$.context_overrides: must be a mapping')
+        global_context = {}
+    site_for_each_organization = config.get('site_for_each_organization', False)
+
+    # A mapping of microsite code and its site specific entry
+    sites = {}
+    for code, microsite in microsites.items():
+        if code == '$' or not isinstance(code, str):
+            continue
+        if microsite is not None and not isinstance(microsite, Mapping):
+            errors.append('microsites.{}: must be a mapping'.format(code))
+            continue
+        if site_for_each_organization:
+            if code not in organizations:
+                errors.append('microsites.{}: no organization with this code'.format(code))
+                continue
+        elif not (microsite or {}).get('name'):
+            errors.append('microsites.{}: missing name'.format(code))
+        elif not isinstance(microsite['name'], str):
+            errors.append('microsites.{}: names must be strings, quote it'.format(code))
+        sites[code] = microsite or {}
+    if site_for_each_organization:
+        sites = {code: sites.get(code, {}) for code in organizations if isinstance(code, str)}
+
+    # A mapping of domain and the code of the microsite that first used it
+    domains = {}
+    for code, microsite in sites.items():
+        site_context = microsite.get('context_overrides') or {}
+        if not isinstance(site_context, Mapping):
+            errors.append('microsites.{}.context_overrides: must be a mapping'.format(code))
+            continue
+        # A mapping of other microsite code and the domains they already use
+        collisions = defaultdict(list)
+        for domain in get_domains(code, main_domain, (global_context, site_context)).values():
+            owner = domains.setdefault(domain, code)
+            if owner != code:
+                collisions[owner].append(domain)
+        for owner, owner_domains in collisions.items():
+            errors.append('microsites.{}: {} already used by {}'.format(code, ', '.join(owner_domains), owner))
+
+    return errors
+
+
+def check_config(config, source='configuration'):
+    """
+    Raise a ConfigError listing every error of a parsed configuration, if any.
+    """
+    errors = validate_config(config)
+    if errors:
+        raise ConfigError(errors, source)
+
+
+if __name__ == '__main__':
+    # imported here, as generator_utils imports this module to validate configurations
+    from generator_utils import read_config
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = ArgumentParser(description="Check a configuration file or directory, without django.")
+    parser.add_argument(
+        "ConfigFilePath", metavar='config_file_path', type=str, help="Configuration data file or directory path."
+    )
+    cli_args = parser.parse_args()
+
+    try:
+        check_config(read_config(cli_args.ConfigFilePath), cli_args.ConfigFilePath)
+    except ConfigError as error:
+        logger.error(str(error))
+        sys.exit(1)
+    logger.info('{} is valid'.format(cli_args.ConfigFilePath))